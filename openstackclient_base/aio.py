@@ -0,0 +1,487 @@
+# Copyright 2013 Grid Dynamics.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Asynchronous clients running on the trollius (asyncio) event loop.
+
+Requests are sent over non-blocking keep-alive connections driven by the
+event loop, so any number of concurrent API calls share a single thread.
+
+Usage::
+
+    class AsyncComputeClient(AsyncBaseClient):
+        service_type = "compute"
+
+    http_client = AsyncHttpClient(username="...", password="...",
+                                  tenant_name="...", auth_uri="...")
+    compute = AsyncComputeClient(http_client)
+
+    @trollius.coroutine
+    def show(server_id):
+        resp, body = yield trollius.From(
+            compute.get("/servers/%s" % server_id))
+        print body["server"]["status"]
+"""
+
+import logging
+import ssl
+import urllib
+import urlparse
+import zlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import trollius
+
+from openstackclient_base import client
+from openstackclient_base import exceptions
+from openstackclient_base import http_cache
+from openstackclient_base import retry
+
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncResponse(object):
+    """
+    The status and headers of a response, with the parts of the httplib
+    response interface callers of :class:`HttpClient` rely on.
+    """
+
+    def __init__(self, status, reason, headers, will_close=False):
+        self.status = status
+        self.reason = reason
+        self.msg = headers
+        self.will_close = will_close
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name.lower(), default)
+
+    def getheaders(self):
+        return self.msg.items()
+
+    def __getitem__(self, name):
+        return self.msg[name.lower()]
+
+
+class AsyncHttpClient(client.HttpClient):
+    """
+    An :class:`HttpClient` whose request methods are coroutines.
+
+    Authentication, the service catalog, the token cache, retries, error
+    mapping and "request_timing" hooks behave as in :class:`HttpClient`,
+    except that "connect" includes name resolution and the TLS handshake
+    ("dns" and "tls" are None). Bodies may be dicts, lists (sent as JSON)
+    or strings; file-like bodies and ``stream=True`` are not supported.
+
+    :param loop: event loop to use, the current one by default
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.loop = kwargs.pop("loop", None) or trollius.get_event_loop()
+        super(AsyncHttpClient, self).__init__(*args, **kwargs)
+        self._idle_streams = {}
+        self._async_auth_lock = trollius.Lock(loop=self.loop)
+
+    def _ssl_context(self):
+        kwargs = self.connect_kwargs
+        if kwargs.get("insecure"):
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            context = ssl.create_default_context(cafile=kwargs.get("ca_file"))
+        if kwargs.get("cert_file"):
+            context.load_cert_chain(kwargs["cert_file"],
+                                    kwargs.get("key_file"))
+        return context
+
+    @trollius.coroutine
+    def _open(self, parsed, fresh=False):
+        """Return a (reader, writer, reused) triple for the host of `parsed`.
+        """
+        key = (parsed.scheme, parsed.netloc)
+        idle = self._idle_streams.get(key)
+        while idle and not fresh:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                raise trollius.Return((reader, writer, True))
+            writer.close()
+        use_ssl = parsed.scheme == "https"
+        port = parsed.port or (443 if use_ssl else 80)
+        coro = trollius.open_connection(
+            parsed.hostname, port, loop=self.loop,
+            ssl=self._ssl_context() if use_ssl else None)
+        timeout = self.connect_kwargs.get("timeout")
+        if timeout is not None:
+            coro = trollius.wait_for(coro, timeout, loop=self.loop)
+        reader, writer = yield trollius.From(coro)
+        raise trollius.Return((reader, writer, False))
+
+    def _release(self, parsed, reader, writer):
+        idle = self._idle_streams.setdefault(
+            (parsed.scheme, parsed.netloc), [])
+        if len(idle) < self.connection_pool.maxsize:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        """Close all idle connections."""
+        idle, self._idle_streams = self._idle_streams, {}
+        for streams in idle.itervalues():
+            for reader, writer in streams:
+                writer.close()
+
+    @staticmethod
+    @trollius.coroutine
+    def _read_headers(reader):
+        headers = {}
+        while True:
+            line = yield trollius.From(reader.readline())
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _sep, value = line.partition(":")
+            name = name.strip().lower()
+            value = value.strip()
+            if name in headers:
+                value = "%s, %s" % (headers[name], value)
+            headers[name] = value
+        raise trollius.Return(headers)
+
+    @trollius.coroutine
+    def _exchange(self, reader, writer, method, data):
+        writer.write(data)
+        yield trollius.From(writer.drain())
+        line = yield trollius.From(reader.readline())
+        if not line:
+            raise EOFError("Connection closed by server")
+        parts = line.split(None, 2)
+        version, status = parts[0], int(parts[1])
+        reason = parts[2].strip() if len(parts) > 2 else ""
+        headers = yield trollius.From(self._read_headers(reader))
+        connection = headers.get("connection", "").lower()
+        will_close = (connection == "close" or
+                      (version == "HTTP/1.0" and connection != "keep-alive"))
+        resp = AsyncResponse(status, reason, headers, will_close)
+        resp.received = self.loop.time()
+
+        if method == "HEAD" or status in (204, 304) or status < 200:
+            body = ""
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                line = yield trollius.From(reader.readline())
+                size = int(line.split(";", 1)[0].strip(), 16)
+                if not size:
+                    # skip the trailer
+                    yield trollius.From(self._read_headers(reader))
+                    break
+                chunks.append((yield trollius.From(reader.readexactly(size))))
+                yield trollius.From(reader.readexactly(2))
+            body = "".join(chunks)
+        elif "content-length" in headers:
+            body = yield trollius.From(
+                reader.readexactly(int(headers["content-length"])))
+        else:
+            body = yield trollius.From(reader.read())
+            resp.will_close = True
+        raise trollius.Return((resp, body))
+
+    @trollius.coroutine
+    def request(self, uri, method, **kwargs):
+        """Coroutine counterpart of :meth:`HttpClient.request`."""
+        policy = kwargs.get("retry_policy")
+        if policy is None:
+            policy = self.retry_policy
+        start = self.loop.time()
+        retries = 0
+        while True:
+            try:
+                result = yield trollius.From(
+                    self._request(uri, method, **kwargs))
+                raise trollius.Return(result)
+            except exceptions.HttpException as e:
+                if not policy:
+                    raise
+                delay = policy.next_delay(
+                    method, e, retries, self.loop.time() - start)
+                if delay is None:
+                    raise
+                LOG.warning("%s %s failed with HTTP %s, retrying in %.2fs",
+                            method, uri, e.code, delay)
+                yield trollius.From(trollius.sleep(delay, loop=self.loop))
+                retries += 1
+
+    @trollius.coroutine
+    def _request(self, uri, method, **kwargs):
+        params = kwargs.get("params", None)
+        if params:
+            uri = "?".join(
+                (uri, urllib.urlencode(params)))
+
+        parsed = urlparse.urlsplit(uri)
+        if not parsed.netloc:
+            parsed = urlparse.urlsplit("http://%s" % uri)
+        request_uri = ("?".join([parsed.path, parsed.query])
+                       if parsed.query
+                       else parsed.path)
+
+        headers = kwargs.get("headers", {})
+        headers["User-Agent"] = self.USER_AGENT
+        body = kwargs.get("body", None)
+        if isinstance(body, (dict, list)):
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body)
+        elif body is not None:
+            headers["Content-Type"] = "application/octet-stream"
+        if body is not None and not isinstance(body, basestring):
+            raise TypeError("Unsupported body type: %s" % body.__class__)
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        compression = kwargs.get("compression")
+        if compression is None:
+            compression = self.compression
+        if compression:
+            headers.setdefault("Accept-Encoding", "gzip, deflate")
+        cached, headers = self._cache_lookup(
+            uri, method, headers,
+            kwargs.get("stream", False) or not kwargs.get("read_body", True))
+
+        lines = ["%s %s HTTP/1.1" % (method, request_uri or "/"),
+                 "Host: %s" % parsed.netloc]
+        for header, value in headers.iteritems():
+            if header.lower() not in ("host", "content-length"):
+                lines.append("%s: %s" % (header, value))
+        if body is not None or method.lower() in ("post", "put"):
+            lines.append("Content-Length: %d" % len(body or ""))
+        data = "%s\r\n\r\n" % "\r\n".join(lines)
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        data += body or ""
+
+        resp, resp_body = None, None
+        timing = None
+        if self._hooks_map.get("request_timing"):
+            timing = {"method": method,
+                      "uri": uri,
+                      "service_type": kwargs.get("service_type"),
+                      "request_bytes": len(body or ""),
+                      "dns": None,
+                      "tls": None}
+        start = self.loop.time()
+        try:
+            reader, writer, reused = yield trollius.From(self._open(parsed))
+            opened = self.loop.time()
+            try:
+                resp, resp_body = yield trollius.From(
+                    self._exchange(reader, writer, method, data))
+            except (EnvironmentError, EOFError):
+                writer.close()
+                # NOTE: the server may have closed an idle connection;
+                #     whether it got the request cannot be told, so only
+                #     idempotent requests are sent again
+                if (not reused or method.upper() not in
+                        retry.RetryPolicy.IDEMPOTENT_METHODS):
+                    raise
+                reader, writer, reused = yield trollius.From(
+                    self._open(parsed, fresh=True))
+                opened = self.loop.time()
+                resp, resp_body = yield trollius.From(
+                    self._exchange(reader, writer, method, data))
+            received = self.loop.time()
+            if resp.will_close:
+                writer.close()
+            else:
+                self._release(parsed, reader, writer)
+        finally:
+            self.http_log(uri, method, headers, body, resp, resp_body)
+
+        wire_bytes = len(resp_body or "")
+        decompressor = None
+        if compression:
+            decompressor = client.Decompressor.for_response(resp)
+        if decompressor is not None and resp_body:
+            try:
+                resp_body = (decompressor.decompress(resp_body) +
+                             decompressor.flush())
+            except zlib.error as e:
+                raise decompressor.error(e)
+        resp_body, revalidated = self._cache_response(
+            uri, method, headers, cached, resp, resp_body)
+        if timing is not None:
+            timing["response_bytes"] = len(resp_body or "")
+            timing["wire_bytes"] = wire_bytes
+            decoding = self.loop.time()
+        try:
+            if resp_body:
+                resp_body = json.loads(resp_body)
+        except (TypeError, ValueError):
+            pass
+        if timing is not None:
+            now = self.loop.time()
+            timing.update({"status": resp.status,
+                           "reused": reused,
+                           "connect": 0 if reused else opened - start,
+                           "ttfb": resp.received - opened,
+                           "transfer": received - resp.received,
+                           "decode": now - decoding,
+                           "total": now - start})
+            self.run_hooks("request_timing", timing)
+
+        status_class = resp.status / 100
+        if revalidated:
+            # a 304 is answered from the cache, not followed
+            status_class = 2
+            resp = http_cache.RevalidatedResponse(resp)
+        if status_class == 3 and method.lower() not in ("post", "put"):
+            result = yield trollius.From(
+                self.request(resp["location"], method, **kwargs))
+            raise trollius.Return(result)
+        if status_class in (4, 5):
+            LOG.error("Request returned failure status.")
+            raise exceptions.from_response(resp, resp_body)
+
+        raise trollius.Return((resp, resp_body))
+
+    @trollius.coroutine
+    def authenticate(self):
+        """Coroutine counterpart of :meth:`HttpClient.authenticate`."""
+        if self._load_cached_access():
+            return
+        resp, body = yield trollius.From(self.request(
+            self.concat_url(self.auth_uri, "/v2.0/tokens"), "POST",
+            body=self._auth_params()))
+        self._store_access(body)
+
+    @trollius.coroutine
+    def ensure_authenticated(self, stale_token=None):
+        """Coroutine counterpart of :meth:`HttpClient.ensure_authenticated`.
+        """
+        if self._has_valid_token(stale_token):
+            return
+        with (yield trollius.From(self._async_auth_lock)):
+            if not self._has_valid_token(stale_token):
+                yield trollius.From(self.authenticate())
+
+    @trollius.coroutine
+    def cs_request(self, client, url, method, **kwargs):
+        """Coroutine counterpart of :meth:`HttpClient.cs_request`."""
+        if self.endpoint:
+            endpoint = self.endpoint
+            token = self.token
+        else:
+            yield trollius.From(self.ensure_authenticated())
+            access = self.access
+            endpoint = self.url_for(
+                client.endpoint_type,
+                client.service_type)
+            client.endpoint = endpoint
+            token = access["token"]["id"]
+
+        kwargs.setdefault("headers", {})
+        kwargs["headers"]["X-Auth-Token"] = token
+        kwargs.setdefault("service_type", client.service_type)
+        try:
+            result = yield trollius.From(self.request(
+                self.concat_url(endpoint, url), method, **kwargs))
+        except exceptions.Unauthorized:
+            if self.endpoint:
+                raise
+            if self.token_cache is not None:
+                self.token_cache.discard(self, token)
+            yield trollius.From(self.ensure_authenticated(stale_token=token))
+            access = self.access
+            endpoint = self.url_for(
+                client.endpoint_type,
+                client.service_type)
+            client.endpoint = endpoint
+            kwargs["headers"]["X-Auth-Token"] = access["token"]["id"]
+            result = yield trollius.From(self.request(
+                self.concat_url(endpoint, url), method, **kwargs))
+        raise trollius.Return(result)
+
+    @trollius.coroutine
+    def map(self, requests, max_workers=8):
+        """Coroutine counterpart of :meth:`HttpClient.map`."""
+        semaphore = trollius.Semaphore(max_workers, loop=self.loop)
+
+        @trollius.coroutine
+        def _cs_request(client, url, method, kwargs):
+            with (yield trollius.From(semaphore)):
+                result = yield trollius.From(
+                    self.cs_request(client, url, method, **kwargs))
+            raise trollius.Return(result)
+
+        results = yield trollius.From(trollius.gather(
+            *[_cs_request(*request)
+              for request in self._expand_requests(requests)],
+            loop=self.loop, return_exceptions=True))
+        raise trollius.Return(results)
+
+
+class AsyncBaseClient(client.BaseClient):
+    """
+    Base class for clients on top of an :class:`AsyncHttpClient`.
+
+    head(), get(), post(), put() and delete() return coroutines, and
+    ``batch().execute()`` is a coroutine too.
+    """
+
+    def __init__(self, http_client, extensions=None):
+        if not isinstance(http_client, AsyncHttpClient):
+            raise TypeError("AsyncBaseClient needs an AsyncHttpClient")
+        super(AsyncBaseClient, self).__init__(http_client, extensions)
+
+
+@trollius.coroutine
+def list_async(manager, url, response_key, obj_class=None, body=None,
+               iterate=None):
+    """Coroutine counterpart of :meth:`base.Manager._list`.
+
+    `manager` must be bound to an :class:`AsyncBaseClient`.
+    """
+    url, iterate = manager._first_page_url(url, iterate)
+
+    results = []
+    new_url = url
+    while True:
+        if body:
+            resp, resp_body = yield trollius.From(
+                manager.api.post(new_url, body=body))
+        else:
+            resp, resp_body = yield trollius.From(manager.api.get(new_url))
+        data = manager._page_data(resp_body, response_key)
+
+        if not data:
+            break
+        if results and results[-1] == data[-1]:
+            break
+
+        results += data
+
+        if not iterate:
+            break
+
+        new_url = manager._next_page_url(url, data)
+        if new_url is None:
+            break
+
+    if obj_class is None:
+        obj_class = manager.resource_class
+    raise trollius.Return(
+        [obj_class(manager, res, loaded=True) for res in results if res])
@@ -18,8 +18,14 @@
 """
 Base utilities to build API operation managers and objects on top of.
 """
+import collections
+import re
+import threading
+import time
+import urllib
 import urlparse
 
+from openstackclient_base import concurrency
 from openstackclient_base import exceptions
 
 
@@ -86,86 +92,453 @@ class HookableMixin(object):
             hook_func(*args, **kwargs)
 
 
+class AdaptivePageSize(object):
+    """
+    A listing page size adjusted to the pages received so far.
+
+    After each full page, the size moves towards the number of items
+    received in `target_time` seconds without exceeding `max_bytes` per
+    page. It changes by at most a factor of two per page and stays within
+    [`minimum`, `maximum`]; `maximum` should not exceed the server limit
+    (osapi_max_limit for nova).
+    """
+
+    def __init__(self, initial=100, minimum=10, maximum=1000,
+                 target_time=2.0, max_bytes=4 * 1024 * 1024):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_time = target_time
+        self.max_bytes = max_bytes
+        self.size = min(max(initial, minimum), maximum)
+
+    def update(self, count, elapsed, nbytes=None):
+        """Account for a page of `count` items received in `elapsed`
+        seconds, `nbytes` long if known.
+        """
+        if count < self.size:
+            # the last page tells nothing about the cost of a full one
+            return
+        ideal = self.target_time * count / max(elapsed, 0.001)
+        if nbytes:
+            ideal = min(ideal, self.max_bytes * count / float(nbytes))
+        ideal = min(max(ideal, self.size / 2), self.size * 2)
+        self.size = int(min(max(ideal, self.minimum), self.maximum))
+
+
+class FindCache(object):
+    """
+    Listings kept by `ManagerWithFind.findall()` for `ttl` seconds.
+
+    One listing is kept per set of server-side filters, up to `maxsize`
+    listings evicted in least recently used order. Each one is indexed on
+    ``id`` and on `attrs`, so that a lookup by any of them is a dict access.
+
+    Usage::
+
+        client.flavors.find_cache = FindCache(ttl=300)
+        client.flavors.find(name="m1.small")    # lists flavors
+        client.flavors.find(name="m1.large")    # served from the cache
+    """
+
+    def __init__(self, ttl=60, maxsize=32, attrs=("name",)):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.attrs = ("id",) + tuple(attr for attr in attrs if attr != "id")
+        self._entries = collections.OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _index(self, items):
+        indexes = dict((attr, {}) for attr in self.attrs)
+        for obj in items:
+            for attr, index in indexes.iteritems():
+                try:
+                    index.setdefault(getattr(obj, attr), []).append(obj)
+                except (AttributeError, TypeError):
+                    continue
+        return indexes
+
+    def candidates(self, filters, searches, load):
+        """Return the cached items that may match `searches`.
+
+        :param filters: server-side filters of the listing
+        :param searches: (attr, value) pairs looked up
+        :param load: called with `filters` to list the items on a miss
+        """
+        key = tuple(sorted(filters.iteritems()))
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key] = entry
+            else:
+                entry = None
+            generation = self._generation
+        if entry is None:
+            items = load(filters)
+            entry = (time.time() + self.ttl, items, self._index(items))
+            with self._lock:
+                # NOTE: do not store a listing that started before the
+                #     last invalidation
+                if generation == self._generation:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+
+        expires, items, indexes = entry
+        for attr, value in searches:
+            try:
+                return indexes[attr].get(value, [])
+            except (KeyError, TypeError):
+                continue
+        return items
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+class BulkResult(object):
+    """
+    The outcome of a bulk operation, item by item in submission order.
+
+    `successes` holds (item, result) pairs, `failures` (item, exception)
+    pairs and `skipped` the items not attempted after a failure when the
+    operation stops on errors.
+    """
+
+    def __init__(self):
+        self.successes = []
+        self.failures = []
+        self.skipped = []
+
+    @property
+    def ok(self):
+        return not self.failures and not self.skipped
+
+    def __repr__(self):
+        return "<BulkResult successes=%s, failures=%s, skipped=%s>" % (
+            len(self.successes), len(self.failures), len(self.skipped))
+
+
+_SKIPPED = object()
+
+
 class Manager(HookableMixin):
     """
     Managers interact with a particular type of API (servers, flavors, images,
     etc.) and provide CRUD operations for them.
     """
     resource_class = None
+    # NOTE: number of pages _list fetches ahead of the consumer in a
+    #     background thread, 0 to fetch them one after another
+    prefetch = 0
+    # NOTE: number of items requested per page by _list, or "adaptive"
+    #     to adjust it with an AdaptivePageSize capped at max_page_size
+    page_size = 1000
+    max_page_size = 1000
+    # NOTE: a FindCache for find()/findall(), emptied by every change
+    #     made through the manager
+    find_cache = None
+    # NOTE: bumped by every change made through the manager, so that
+    #     results cached elsewhere (see utils.find_resource) expire
+    generation = 0
+    # NOTE: a (url, response_key) pair naming a listing with full details,
+    #     read by load_all() instead of getting resources one by one
+    detail_listing = None
 
     def __init__(self, api):
         self.api = api
 
-    def _list(self, url, response_key, obj_class=None, body=None,
-              iterate=None):
+    @staticmethod
+    def _page_url(url, **params):
+        """Return `url` with the given query parameters set or replaced."""
+        parsed = urlparse.urlsplit(url)
+        query = [(k, v)
+                 for k, v in urlparse.parse_qsl(parsed.query, True)
+                 if k not in params]
+        query.extend(params.iteritems())
+        return urlparse.urlunsplit(parsed._replace(
+            query=urllib.urlencode(query)))
+
+    def _first_page_url(self, url, iterate=None, page_size=None):
+        """Return the URL of the first page and whether to fetch more pages.
+
+        A limit already present in `url` is kept and, unless `iterate` is
+        True, means that only one page is wanted.
+        """
+        query = urlparse.parse_qs(urlparse.urlsplit(url).query, True)
         if iterate is None:
-            parsed_url = urlparse.urlparse(url)
-            iterate = True
-            if parsed_url.query:
-                query = parsed_url.query.split('&')
-                for item in query:
-                    if item.startswith("limit"):
-                        iterate = False
-                        break
-                else:
-                    url += "&limit=1000"
-            else:
-                url += "?limit=1000"
+            iterate = "limit" not in query
+        if iterate and "limit" not in query:
+            url = self._page_url(url, limit=page_size or self.page_size)
+        return url, iterate
+
+    @staticmethod
+    def _page_data(resp_body, response_key):
+        data = resp_body[response_key]
+        # NOTE(ja): keystone returns values as list as {'values': [ ... ]}
+        #           unlike other services which just return the list...
+        if type(data) is dict:
+            data = data['values']
+        return data
 
-        results = []
+    @classmethod
+    def _next_page_url(cls, url, data, page_size=None):
+        """Return the URL of the page after `data`, or None."""
+        try:
+            marker = data[-1]["id"]
+        except KeyError:
+            return None
+        if page_size is None:
+            return cls._page_url(url, marker=marker)
+        return cls._page_url(url, marker=marker, limit=page_size)
+
+    def _iter_pages(self, url, response_key, body=None, iterate=None,
+                    page_size=None):
+        if page_size is None:
+            page_size = self.page_size
+        sizer = None
+        if page_size == "adaptive":
+            sizer = AdaptivePageSize(maximum=self.max_page_size)
+        elif isinstance(page_size, AdaptivePageSize):
+            sizer = page_size
+        if sizer is not None:
+            page_size = sizer.size
+        user_limit = "limit" in urlparse.parse_qs(
+            urlparse.urlsplit(url).query, True)
+        url, iterate = self._first_page_url(url, iterate, page_size)
+        if user_limit:
+            # NOTE: never override a limit given by the caller
+            sizer = None
+
+        last = None
         new_url = url
         while True:
             resp = None
+            started = time.time()
             if body:
                 resp, resp_body = self.api.post(new_url, body=body)
             else:
                 resp, resp_body = self.api.get(new_url)
-            data = resp_body[response_key]
-            # NOTE(ja): keystone returns values as list as {'values': [ ... ]}
-            #           unlike other services which just return the list...
-            if type(data) is dict:
-                data = data['values']
+            data = self._page_data(resp_body, response_key)
+            if sizer is not None and data:
+                nbytes = resp.getheader("content-length", None)
+                sizer.update(len(data), time.time() - started,
+                             int(nbytes) if nbytes else None)
 
             if not data:
                 break
-            if results and results[-1] == data[-1]:
+            if last is not None and last == data[-1]:
                 break
+            last = data[-1]
 
-            results += data
+            yield data
 
             if not iterate:
                 break
 
-            try:
-                new_url = "%s&marker=%s" % (url, data[-1]["id"])
-            except KeyError:
+            new_url = self._next_page_url(
+                url, data, sizer.size if sizer is not None else None)
+            if new_url is None:
                 break
 
+    def _iter_list(self, url, response_key, obj_class=None, body=None,
+                   iterate=None, prefetch=None, page_size=None):
+        """Yield the resources of a listing as its pages arrive.
+
+        Only one page is held in memory at a time, plus up to `prefetch`
+        pages requested ahead in the background. `page_size` is a number
+        of items, "adaptive" or an :class:`AdaptivePageSize`. Both default
+        to the attributes of the manager.
+        """
         if obj_class is None:
             obj_class = self.resource_class
-        return [obj_class(self, res, loaded=True) for res in results if res]
+        if prefetch is None:
+            prefetch = self.prefetch
+
+        pages = self._iter_pages(url, response_key, body, iterate, page_size)
+        if prefetch:
+            pages = concurrency.Prefetcher(pages, prefetch)
+        try:
+            for data in pages:
+                for res in data:
+                    if res:
+                        yield obj_class(self, res, loaded=True)
+        finally:
+            pages.close()
+
+    def _list(self, url, response_key, obj_class=None, body=None,
+              iterate=None, prefetch=None, page_size=None):
+        return list(self._iter_list(url, response_key, obj_class, body,
+                                    iterate, prefetch, page_size))
+
+    def _list_details(self, ids):
+        """
+        Return the detailed resources with the given `ids`, or None.
+
+        The `detail_listing` of the manager is read until all of them
+        are found, provided that there are at least a page of them: the
+        listing may have to be read to its end, while GETs run
+        concurrently. Managers whose API has another way to return details
+        for many objects in a few requests override this. load_all() falls
+        back to one GET per resource when it returns None.
+        """
+        page_size = self.page_size
+        if not isinstance(page_size, (int, long)):
+            page_size = self.max_page_size
+        if self.detail_listing is None or len(ids) < page_size:
+            return None
+        url, response_key = self.detail_listing
+        wanted = set(ids)
+        found = []
+        listing = self._iter_list(url, response_key)
+        try:
+            for res in listing:
+                if res.id in wanted:
+                    wanted.discard(res.id)
+                    found.append(res)
+                    if not wanted:
+                        break
+        finally:
+            listing.close()
+        return found
+
+    def load_all(self, resources, attrs=None, max_workers=8):
+        """
+        Load the details of many resources at once.
+
+        Without `attrs`, the resources not loaded yet are fetched; with
+        `attrs`, those lacking any of these attributes are. Details come
+        from _list_details() if the manager supports it, otherwise from
+        concurrent GETs.
+
+        :returns: a list of (resource, exception) pairs for the resources
+            that could not be loaded
+        """
+        def _lacking(res):
+            if attrs is None:
+                return not res.is_loaded()
+            return any(attr not in res.__dict__ and attr not in res._info
+                       for attr in attrs)
+
+        pending = [res for res in resources if _lacking(res)]
+        if not pending:
+            return []
+
+        details = self._list_details([res.id for res in pending])
+        if details is not None:
+            by_id = dict((new.id, new) for new in details)
+            failures = []
+            for res in pending:
+                res.set_loaded(True)
+                try:
+                    res._add_details(by_id[res.id]._info)
+                except KeyError:
+                    failures.append((res, exceptions.NotFound(
+                        404, "%s %s not found" %
+                        (res.__class__.__name__, res.id))))
+            return failures
+
+        outcomes = concurrency.run_all(
+            [(res.get, (), {}) for res in pending], max_workers)
+        return [(res, outcome)
+                for res, outcome in zip(pending, outcomes)
+                if isinstance(outcome, Exception)]
+
+    def _run_many(self, fn, items, max_workers=8, stop_on_error=False):
+        """
+        Call `fn` for each item concurrently and return a BulkResult.
+
+        An item is passed as the positional arguments if it is a tuple,
+        the keyword arguments if it is a dict, or the only argument
+        otherwise. With `stop_on_error`, items not started yet when a call
+        fails are skipped.
+        """
+        stop = threading.Event()
+
+        def _call(item):
+            if stop.is_set():
+                return _SKIPPED
+            try:
+                if isinstance(item, tuple):
+                    return fn(*item)
+                if isinstance(item, dict):
+                    return fn(**item)
+                return fn(item)
+            except Exception:
+                if stop_on_error:
+                    stop.set()
+                raise
+
+        items = list(items)
+        result = BulkResult()
+        for item, outcome in zip(items, concurrency.run_all(
+                [(_call, (item,), {}) for item in items], max_workers)):
+            if outcome is _SKIPPED:
+                result.skipped.append(item)
+            elif isinstance(outcome, Exception):
+                result.failures.append((item, outcome))
+            else:
+                result.successes.append((item, outcome))
+        return result
+
+    def create_many(self, items, max_workers=8, stop_on_error=False):
+        """
+        Create many resources concurrently with the create() method.
+
+        :param items: the arguments of each create() call, as a dict of
+            keyword arguments or a tuple of positional ones
+        :rtype: :class:`BulkResult`
+        """
+        return self._run_many(self.create, items, max_workers, stop_on_error)
+
+    def delete_many(self, resources, max_workers=8, stop_on_error=False):
+        """
+        Delete many resources (or their IDs) concurrently.
+
+        :rtype: :class:`BulkResult`
+        """
+        return self._run_many(self.delete, resources, max_workers,
+                              stop_on_error)
+
+    def invalidate(self):
+        """Forget the listings cached for find() and findall()."""
+        self.generation += 1
+        if self.find_cache is not None:
+            self.find_cache.clear()
 
     def _get(self, url, response_key):
         resp, body = self.api.get(url)
         return self.resource_class(self, body[response_key])
 
     def _create(self, url, body, response_key, return_raw=False):
-        resp, body = self.api.post(url, body=body)
+        try:
+            resp, body = self.api.post(url, body=body)
+        finally:
+            self.invalidate()
         if return_raw:
             return body[response_key]
         return self.resource_class(self, body[response_key])
 
     def _delete(self, url):
-        resp, body = self.api.delete(url)
+        try:
+            resp, body = self.api.delete(url)
+        finally:
+            self.invalidate()
 
     def _update(self, url, body, response_key=None, method="PUT"):
         methods = {"PUT": self.api.put,
                    "POST": self.api.post}
         try:
-            resp, body = methods[method](url, body=body)
+            request = methods[method]
         except KeyError:
             raise exceptions.ClientException("Invalid update method: %s"
                                              % method)
+        try:
+            resp, body = request(url, body=body)
+        finally:
+            self.invalidate()
         # PUT requests may not return a body
         if body:
             if response_key is not None:
@@ -174,16 +547,41 @@ class Manager(HookableMixin):
                 return body
 
 
+# NOTE: characters special in POSIX extended and Python regular expressions
+_REGEX_SPECIAL = re.compile(r"([.^$*+?{}()\[\]\\|])")
+
+
 class ManagerWithFind(Manager):
     """
     Like a `Manager`, but with additional `find()`/`findall()` methods.
     """
+    # NOTE: attributes the list() of the manager can filter on through its
+    #     search_opts argument; findall() sends them to the server
+    filter_attrs = ()
+    # NOTE: attributes of filter_attrs the server matches as regular
+    #     expressions (nova does so for server names); their values are
+    #     sent escaped and anchored
+    regex_filter_attrs = ()
+
+    def _filter_value(self, attr, value):
+        if attr in self.regex_filter_attrs and isinstance(value, basestring):
+            return "^%s$" % _REGEX_SPECIAL.sub(r"\\\1", value)
+        return value
+
+    def _list_matching(self, filters):
+        """
+        Return the items the server selects with the `filters` dict.
+        """
+        if filters:
+            return self.list(search_opts=filters)
+        return self.list()
+
     def find(self, **kwargs):
         """
         Find a single item with attributes matching ``**kwargs``.
 
-        This isn't very efficient: it loads the entire list then filters on
-        the Python side.
+        Attributes listed in `filter_attrs` are filtered by the server,
+        the others on the Python side after loading the list.
         """
         rl = self.findall(**kwargs)
         try:
@@ -196,13 +594,23 @@ class ManagerWithFind(Manager):
         """
         Find all items with attributes matching ``**kwargs``.
 
-        This isn't very efficient: it loads the entire list then filters on
-        the Python side.
+        Attributes listed in `filter_attrs` are filtered by the server,
+        the others on the Python side after loading the list.
         """
         found = []
         searches = kwargs.items()
-
-        for obj in self.list():
+        filters = dict((attr, self._filter_value(attr, value))
+                       for (attr, value) in searches
+                       if attr in self.filter_attrs)
+
+        # NOTE: server-side filters may be looser than equality (nova
+        #     matches a status case-insensitively), so check them all
+        if self.find_cache is not None:
+            candidates = self.find_cache.candidates(
+                filters, searches, self._list_matching)
+        else:
+            candidates = self._list_matching(filters)
+        for obj in candidates:
             try:
                 if all(getattr(obj, attr) == value
                        for (attr, value) in searches):
@@ -218,10 +626,17 @@ class Resource(object):
     A resource represents a particular instance of an object (tenant, user,
     etc). This is pretty much just a bag for attributes.
 
+    In compact mode, enabled by setting the `compact` class attribute,
+    attributes are read from `_info` instead of being copied to the
+    instance, which halves the memory used by large listings. Class
+    attributes then take precedence over `_info` keys of the same name.
+
     :param manager: Manager object
     :param info: dictionary representing resource attributes
     :param loaded: prevent lazy-loading if set to True
     """
+    compact = False
+
     def __init__(self, manager, info, loaded=False):
         self.manager = manager
         self._info = info
@@ -229,6 +644,12 @@ class Resource(object):
         self._loaded = loaded
 
     def _add_details(self, info):
+        if self.compact:
+            if info is not self._info:
+                merged = dict(self._info)
+                merged.update(info)
+                self._info = merged
+            return
         for (k, v) in info.iteritems():
             try:
                 setattr(self, k, v)
@@ -238,6 +659,10 @@ class Resource(object):
 
     def __getattr__(self, k):
         if k not in self.__dict__:
+            if self.compact:
+                info = self.__dict__.get("_info")
+                if info is not None and k in info:
+                    return info[k]
             #NOTE(bcwaldon): disallow lazy-loading if already loaded once
             if not self.is_loaded():
                 self.get()
@@ -248,7 +673,10 @@ class Resource(object):
             return self.__dict__[k]
 
     def __repr__(self):
-        reprkeys = sorted(k for k in self.__dict__.keys() if k[0] != '_' and
+        keys = set(self.__dict__)
+        if self.compact:
+            keys.update(self._info)
+        reprkeys = sorted(k for k in keys if k[0] != '_' and
                           k != 'manager')
         info = ", ".join("%s=%s" % (k, getattr(self, k)) for k in reprkeys)
         return "<%s %s>" % (self.__class__.__name__, info)
@@ -10,10 +10,20 @@ OpenStack Client interface. Handles the REST calls and responses.
 """
 
 
+import calendar
+import collections
 import errno
 import logging
+import mmap
 import re
 import os
+import select
+import socket
+import ssl
+import stat
+import threading
+import time
+import zlib
 
 import httplib
 import urlparse
@@ -36,12 +46,37 @@ if not hasattr(urlparse, "parse_qsl"):
     urlparse.parse_qsl = cgi.parse_qsl
 
 
+from openstackclient_base import base
+from openstackclient_base import concurrency
 from openstackclient_base import exceptions
+from openstackclient_base import http_cache
+from openstackclient_base import retry
 
 
 LOG = logging.getLogger(__name__)
 CHUNKSIZE = 65536
 VERSION_REGEX = re.compile(r"v\d+\.?\d*")
+ISOTIME_REGEX = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)"
+                           r"(?:\.\d+)?(?:Z|([+-])(\d\d):?(\d\d))?$")
+
+
+def token_expires(access):
+    """Return the expiration time of a keystone token as a UNIX timestamp.
+
+    None is returned if `access` has no parsable ``token.expires`` field.
+    """
+    try:
+        match = ISOTIME_REGEX.match(access["token"]["expires"])
+    except (KeyError, TypeError):
+        return None
+    if not match:
+        return None
+    groups = match.groups()
+    timestamp = calendar.timegm([int(x) for x in groups[:6]])
+    if groups[6]:
+        offset = int(groups[7]) * 3600 + int(groups[8]) * 60
+        timestamp += -offset if groups[6] == "+" else offset
+    return timestamp
 
 
 def seekable(body):
@@ -61,11 +96,83 @@ def sendable(body):
             seekable(body))
 
 
-def body_iterator(connection, body):
-    if sendable(body) and isinstance(connection, httplib.HTTPConnection):
-        return SendFileIterator(connection, body)
+def mappable(body):
+    """Tell whether `body` is a non-empty regular file."""
+    try:
+        st = os.fstat(body.fileno())
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_size > 0
+
+
+def send_all(sock, data):
+    """Send a string or buffer to `sock` without copying it.
+
+    Unlike socket.sendall(), slices of `data` left to send after a
+    partial write of an SSL socket are views, not copies.
+    """
+    length = len(data)
+    sent = sock.send(data)
+    while sent < length:
+        sent += sock.send(buffer(data, sent))
+
+
+def digest_file(fd, digest, chunk_size=1024 * 1024):
+    """Update `digest` with the whole content of the file open as `fd`.
+
+    The file is read through a duplicate descriptor from its start;
+    hashlib releases the GIL on large updates, so this can run in a
+    thread while sendfile() transmits the same file.
+    """
+    fd = os.dup(fd)
+    try:
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            data = os.read(fd, chunk_size)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        os.close(fd)
+
+
+def _replayable(body):
+    return body is None or isinstance(body, (basestring, dict, list))
+
+
+def set_cork(sock, cork):
+    """Hold partial segments on `sock` until uncorked, where supported."""
+    if getattr(socket, "TCP_CORK", None) is None or sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(cork))
+    except socket.error:
+        pass
+
+
+def auto_chunk_size(connection):
+    """Return a chunk size matching the send buffer of `connection`."""
+    if connection.sock is None:
+        connection.connect()
+    try:
+        sndbuf = connection.sock.getsockopt(socket.SOL_SOCKET,
+                                            socket.SO_SNDBUF)
+    except socket.error:
+        return CHUNKSIZE
+    # NOTE: Linux reports twice the size it accounts payload for
+    return min(max(sndbuf / 2, 16384), 4 * 1024 * 1024)
+
+
+def body_iterator(connection, body, chunk_size=CHUNKSIZE, map_file=False):
+    # NOTE: HTTPSConnection is an HTTPConnection too, but sendfile()
+    #     would bypass TLS; Python 2 cannot enable kernel TLS offload
+    tls = isinstance(connection, httplib.HTTPSConnection)
+    if sendable(body) and not tls:
+        return SendFileIterator(connection, body, chunk_size)
+    elif map_file and mappable(body):
+        return MmapIterator(body, chunk_size)
     elif hasattr(body, "read"):
-        return FileReaderIterator(body)
+        return FileReaderIterator(body, chunk_size)
     elif isinstance(body, collections.Iterable):
         return body
     else:
@@ -79,12 +186,13 @@ class FileReaderIterator(object):
     chunks of data.
     """
 
-    def __init__(self, source):
+    def __init__(self, source, chunk_size=CHUNKSIZE):
         """
         Constructs the object from a readable image source
         (such as an HTTPResponse or file-like object)
         """
         self.source = source
+        self.chunk_size = chunk_size
 
     def __iter__(self):
         """
@@ -92,21 +200,55 @@ class FileReaderIterator(object):
         image file.
         """
         while True:
-            chunk = self.source.read(CHUNKSIZE)
+            chunk = self.source.read(self.chunk_size)
             if chunk:
                 yield chunk
             else:
                 break
 
 
+class MmapIterator(object):
+    """
+    Iterate over the chunks of a regular file from its current position
+    as buffers into a read-only memory map, which are never copied into
+    Python strings.
+
+    The file must not shrink meanwhile: reading a mapped page past its
+    new end raises SIGBUS, which kills the process.
+    """
+
+    def __init__(self, source, chunk_size=CHUNKSIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        fd = self.source.fileno()
+        if hasattr(self.source, "tell"):
+            start = self.source.tell()
+        else:
+            start = os.lseek(fd, 0, os.SEEK_CUR)
+        size = os.fstat(fd).st_size
+        if start >= size:
+            return
+        mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(start, size, self.chunk_size):
+                yield buffer(mapped, offset, self.chunk_size)
+        finally:
+            mapped.close()
+        if hasattr(self.source, "seek"):
+            self.source.seek(size)
+
+
 class SendFileIterator(object):
     """
     Emulate iterator pattern over sendfile, in order to allow
     send progress be followed by wrapping the iteration.
     """
-    def __init__(self, connection, body):
+    def __init__(self, connection, body, chunk_size=CHUNKSIZE):
         self.connection = connection
         self.body = body
+        self.chunk_size = chunk_size
         self.offset = 0
         self.sending = True
 
@@ -123,7 +265,7 @@ class SendFileIterator(object):
                 sent = sendfile.sendfile(self.connection.sock.fileno(),
                                          self.body.fileno(),
                                          self.offset,
-                                         CHUNKSIZE)
+                                         self.chunk_size)
             except OSError as e:
                 # suprisingly, sendfile may fail transiently instead of
                 # blocking, in which case we select on the socket in order
@@ -141,7 +283,194 @@ class SendFileIterator(object):
             yield OfLength(sent)
 
 
-class HTTPSClientAuthConnection(httplib.HTTPSConnection):
+class Decompressor(object):
+    """
+    Incrementally decode a gzip or deflate content-coding.
+    """
+
+    ENCODINGS = ("gzip", "deflate")
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._first = True
+        if encoding == "gzip":
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._obj = zlib.decompressobj()
+
+    def decompress(self, data):
+        if self._first and data:
+            self._first = False
+            if self.encoding == "deflate":
+                # NOTE: some servers send raw deflate data instead of
+                #     the zlib format required by HTTP/1.1
+                try:
+                    return self._obj.decompress(data)
+                except zlib.error:
+                    self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def error(self, e):
+        """Return the exception to raise for the zlib.error `e`."""
+        return exceptions.ClientException(
+            "Cannot decode %s response body: %s" % (self.encoding, e))
+
+    @classmethod
+    def for_response(cls, resp):
+        """Return a Decompressor for the Content-Encoding of `resp`, if any.
+        """
+        encoding = (resp.getheader("content-encoding") or "").lower()
+        return cls(encoding) if encoding in cls.ENCODINGS else None
+
+
+class ResponseBodyIterator(object):
+    """
+    An iterator over the chunks of a response body, read from the socket
+    as they are consumed and decompressed if `decompressor` is given.
+
+    The connection is released once the body is exhausted; call close()
+    to abandon a partially read body. `bytes_read` counts the bytes read
+    from the socket and `bytes_decoded` those handed to the consumer,
+    which also update `digest` if given.
+    """
+
+    def __init__(self, resp, release=None, chunk_size=CHUNKSIZE,
+                 decompressor=None, digest=None):
+        self.resp = resp
+        self.release = release
+        self.chunk_size = chunk_size
+        self.decompressor = decompressor
+        self.digest = digest
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+
+    def __iter__(self):
+        decompressor = self.decompressor
+        while True:
+            try:
+                chunk = self.resp.read(self.chunk_size)
+                self.bytes_read += len(chunk)
+                if decompressor is None:
+                    data = chunk
+                elif chunk:
+                    data = decompressor.decompress(chunk)
+                else:
+                    data = decompressor.flush()
+            except zlib.error as e:
+                self._finish(False)
+                raise decompressor.error(e)
+            except Exception:
+                self._finish(False)
+                raise
+            if data:
+                self.bytes_decoded += len(data)
+                if self.digest is not None:
+                    self.digest.update(data)
+                yield data
+            if not chunk:
+                break
+        self._finish(True)
+
+    def _finish(self, reusable):
+        release, self.release = self.release, None
+        if release is not None:
+            release(reusable)
+
+    def close(self):
+        """Drop the connection without reading the rest of the body."""
+        self._finish(False)
+
+
+def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                      source_address=None, timings=None):
+    """Connect a TCP socket like socket.create_connection().
+
+    If `timings` is a dict, the time spent resolving the host name and
+    establishing the connection is stored in its "dns" and "connect" keys.
+    """
+    host, port = address
+    start = time.time()
+    addrinfo = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    resolved = time.time()
+    error = None
+    for af, socktype, proto, canonname, sa in addrinfo:
+        sock = None
+        try:
+            sock = socket.socket(af, socktype, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sa)
+        except socket.error as e:
+            error = e
+            if sock is not None:
+                sock.close()
+            continue
+        if timings is not None:
+            timings["dns"] = resolved - start
+            timings["connect"] = time.time() - resolved
+        return sock
+    if error is not None:
+        raise error
+    raise socket.error("getaddrinfo returns an empty list")
+
+
+class SendTrackingMixin:
+    """
+    Note in `request_sent` whether the server may have received anything
+    since the flag was last cleared.
+    """
+
+    request_sent = False
+
+    def send(self, data):
+        if self.sock is None and self.auto_open:
+            self.connect()
+        # NOTE: set before sending, since sendall() may fail half-way
+        self.request_sent = True
+        httplib.HTTPConnection.send(self, data)
+
+
+class TimedHTTPConnection(SendTrackingMixin, httplib.HTTPConnection):
+    """
+    An HTTPConnection recording in `timings` how long connecting took.
+    """
+
+    timings = None
+
+    def connect(self):
+        self.timings = {}
+        self.sock = create_connection((self.host, self.port), self.timeout,
+                                      getattr(self, "source_address", None),
+                                      self.timings)
+        if getattr(self, "_tunnel_host", None):
+            self._tunnel()
+
+
+class TimedHTTPSConnection(SendTrackingMixin, httplib.HTTPSConnection):
+    """
+    An HTTPSConnection recording in `timings` how long connecting took.
+
+    Name resolution and the TLS handshake are left to httplib, which
+    sets them up differently in every Python version, so they are
+    included in the "connect" time.
+    """
+
+    timings = None
+
+    def connect(self):
+        start = time.time()
+        httplib.HTTPSConnection.connect(self)
+        self.timings = {"connect": time.time() - start,
+                        "dns": None,
+                        "tls": None}
+
+
+class HTTPSClientAuthConnection(SendTrackingMixin, httplib.HTTPSConnection):
     """
     Class to make a HTTPS connection, with support for
     full client-based SSL Authentication
@@ -170,10 +499,13 @@ class HTTPSClientAuthConnection(httplib.HTTPSConnection):
         ssl.wrap_socket(), which forces SSL to check server certificate against
         our client certificate.
         """
-        sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.timings = {}
+        sock = create_connection((self.host, self.port), self.timeout,
+                                 timings=self.timings)
         if self._tunnel_host:
             self.sock = sock
             self._tunnel()
+        start = time.time()
         # Check CA file unless 'insecure' is specificed
         if self.insecure is True:
             self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file,
@@ -182,11 +514,109 @@ class HTTPSClientAuthConnection(httplib.HTTPSConnection):
             self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file,
                                         ca_certs=self.ca_file,
                                         cert_reqs=ssl.CERT_REQUIRED)
+        self.timings["tls"] = time.time() - start
+
+
+def is_stale(connection):
+    """Check whether an idle keep-alive connection was dropped by the peer.
+
+    An idle HTTP connection must not have anything to read; if its socket
+    polls readable, the server has either closed it or sent garbage.
+    """
+    sock = connection.sock
+    if sock is None:
+        return False
+    try:
+        rlist, wlist, xlist = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return bool(rlist)
+
+
+class ConnectionPool(object):
+    """
+    A bounded, thread-safe pool of HTTP/1.1 keep-alive connections.
 
+    Idle connections are kept per (scheme, netloc) and handed out again
+    to subsequent requests for the same host. At most `maxsize` idle
+    connections are kept per host; extra ones are closed on release.
+    """
 
-class HttpClient(object):
+    def __init__(self, maxsize=10, connect_kwargs=None):
+        self.maxsize = maxsize
+        self.connect_kwargs = connect_kwargs or {}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def new_connection(self, scheme, netloc):
+        if scheme == "https":
+            if "ca_file" in self.connect_kwargs:
+                return HTTPSClientAuthConnection(netloc, None,
+                                                 **self.connect_kwargs)
+            return TimedHTTPSConnection(netloc, **self.connect_kwargs)
+        # SSL-only arguments make no sense for plain HTTP
+        kwargs = dict((key, value)
+                      for key, value in self.connect_kwargs.iteritems()
+                      if key == "timeout")
+        return TimedHTTPConnection(netloc, **kwargs)
+
+    def get(self, scheme, netloc):
+        """Return a (connection, reused) pair for the given host.
+
+        Stale idle connections are discarded and replaced transparently.
+        """
+        key = (scheme, netloc)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                connection = idle.pop() if idle else None
+            if connection is None:
+                return self.new_connection(scheme, netloc), False
+            if not is_stale(connection):
+                return connection, True
+            connection.close()
+
+    def put(self, scheme, netloc, connection):
+        """Return a connection to the pool once its response is read."""
+        key = (scheme, netloc)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.itervalues():
+            for connection in connections:
+                connection.close()
+
+
+class HttpClient(base.HookableMixin):
+    """
+    Send requests to OpenStack services and keep track of authentication.
+
+    Timing of each request can be observed with a "request_timing" hook::
+
+        HttpClient.add_hook("request_timing", lambda timing: ...)
+
+    The hook receives a dict with the request "method", "uri",
+    "service_type", "status", whether the connection was "reused",
+    the "request_bytes", "response_bytes" (decompressed) and "wire_bytes"
+    (as received) counts, and durations in seconds: "dns", "connect",
+    "tls" (zero on reused connections; "dns" and "tls" are None for HTTPS
+    connections without a client certificate, where they are part of
+    "connect"), "ttfb" (from sending the request to receiving the response
+    headers), "transfer" (reading the body), "decode" (JSON parsing) and
+    "total".
+    Nothing is measured if no hook is registered.
+    """
 
     USER_AGENT = "python-openstackclient-base"
+    _hooks_map = {}
 
     def __init__(self, username=None, tenant_id=None, tenant_name=None,
                  password=None, auth_url=None, auth_uri=None,
@@ -195,7 +625,9 @@ class HttpClient(object):
                  callback=None,
                  use_ssl=False, insecure=False,
                  key_file=None, cert_file=None, ca_file=None,
-                 timeout=None):
+                 timeout=None, pool_maxsize=10,
+                 token_cache=None, refresh_margin=60,
+                 retry_policy=None, compression=False, http_cache=None):
         self.username = username
         self.tenant_id = tenant_id
         self.tenant_name = tenant_name
@@ -206,12 +638,25 @@ class HttpClient(object):
         self.region_name = region_name
         self.access = access
         self.callback = callback
+        self.token_cache = token_cache
+        # NOTE: tokens expiring within refresh_margin seconds are renewed
+        #     before use; _auth_lock lets one thread at a time do it
+        self.refresh_margin = refresh_margin
+        self._auth_lock = threading.Lock()
+        # NOTE: expiry of a token that re-authenticating did not extend
+        self._unrenewable_expires = None
+        self.retry_policy = retry_policy
+        # NOTE: ask for gzip or deflate encoded responses; they are
+        #     decoded transparently, including streamed bodies
+        self.compression = compression
+        # NOTE: an http_cache.HttpCache revalidating GET responses
+        self.http_cache = http_cache
 
         connect_kwargs = {} if timeout is None else {"timeout": timeout}
 
         self.use_ssl = use_ssl
         if use_ssl:
-            if (cert_file is not None) != (key_file is None):
+            if (cert_file is None) != (key_file is None):
                 raise ValueError("cert_file and key_file"
                                  "should be both None or not None")
 
@@ -223,6 +668,55 @@ class HttpClient(object):
                 connect_kwargs[arg] = locals()[arg]
 
         self.connect_kwargs = connect_kwargs
+        # NOTE: the pool is shared by every BaseClient using this HttpClient
+        self.connection_pool = ConnectionPool(pool_maxsize, connect_kwargs)
+
+    @property
+    def access(self):
+        return self._access
+
+    @access.setter
+    def access(self, access):
+        # NOTE: the catalog index is rebuilt whenever we (re)authenticate
+        self._access = access
+        self._catalog_index = self._index_catalog(access)
+
+    @staticmethod
+    def _index_catalog(access):
+        """Index the service catalog for endpoint lookups.
+
+        Returns a pair of dicts. The first maps (service_type,
+        endpoint_type, region) to the list of endpoint URLs, the second maps
+        (service_type, region) to the list of endpoint dicts. Entries with
+        region None cover all regions. Both keep the catalog order.
+        """
+        urls = {}
+        endpoints = {}
+        for service in (access or {}).get("serviceCatalog", []):
+            service_type = service["type"]
+            endpoints.setdefault((service_type, None), [])
+            for endpoint in service["endpoints"]:
+                regions = [None]
+                if endpoint.get("region") is not None:
+                    regions.append(endpoint["region"])
+                for region in regions:
+                    endpoints.setdefault((service_type, region),
+                                         []).append(endpoint)
+                for endpoint_type, url in endpoint.iteritems():
+                    if not endpoint_type.endswith("URL"):
+                        continue
+                    for region in regions:
+                        urls.setdefault((service_type, endpoint_type, region),
+                                        []).append(url)
+        return urls, endpoints
+
+    def endpoints_for(self, endpoint_type, service_type, region_name=None):
+        """Return all URLs of the given type for a service, in catalog order.
+        """
+        if not region_name:
+            region_name = self.region_name
+        return self._catalog_index[0].get(
+            (service_type, endpoint_type, region_name), [])
 
     def url_for(self, endpoint_type, service_type, region_name=None):
         """Fetch an endpoint from the service catalog.
@@ -233,25 +727,16 @@ class HttpClient(object):
 
         See tests for a sample service catalog.
         """
-        catalog = self.access.get("serviceCatalog", [])
         # NOTE(imelnikov): for unbound tokens, we get no endpoints,
         #     but we are still able to use public identity service
-        if (not catalog and endpoint_type == 'publicURL'
+        if (not self.access.get("serviceCatalog")
+                and endpoint_type == 'publicURL'
                 and service_type == 'identity'):
             return self.auth_uri
-        if not region_name:
-            region_name = self.region_name
-        for service in catalog:
-            if service["type"] != service_type:
-                continue
-
-            endpoints = service["endpoints"]
-            for endpoint in endpoints:
-                if region_name and endpoint["region"] != region_name:
-                    continue
-                return endpoint[endpoint_type]
-
-        raise exceptions.EndpointNotFound("Endpoint not found.")
+        urls = self.endpoints_for(endpoint_type, service_type, region_name)
+        if not urls:
+            raise exceptions.EndpointNotFound("Endpoint not found.")
+        return urls[0]
 
     def get_endpoints(self, endpoint_type=None,
                       service_type=None, region_name=None):
@@ -260,24 +745,44 @@ class HttpClient(object):
         Returns endpoints for the specified service (or all) and
         that contain the specified type (or all).
         """
-        sc = {}
         if not region_name:
             region_name = self.region_name
-        for service in self.access.get("serviceCatalog", []):
-            if service_type and service_type != service["type"]:
-                continue
-            sc[service["type"]] = []
-            for endpoint in service["endpoints"]:
-                if endpoint_type and endpoint_type not in endpoint.keys():
-                    continue
-                if region_name and endpoint["region"] != region_name:
-                    continue
-                sc[service["type"]].append(endpoint)
+        index = self._catalog_index[1]
+        if service_type:
+            service_types = [service_type] if (service_type, None) in index \
+                else []
+        else:
+            service_types = [key[0] for key in index if key[1] is None]
+        sc = {}
+        for service_type in service_types:
+            sc[service_type] = [
+                endpoint
+                for endpoint in index.get((service_type, region_name), [])
+                if not endpoint_type or endpoint_type in endpoint]
         return sc
 
     def authenticate(self):
         """ Authenticate against the keystone API v2.0.
+
+        If a `token_cache` is set, a still valid ``access`` issued for the
+        same credentials is taken from it instead.
         """
+        if self._load_cached_access():
+            return
+        resp, body = self.request(
+            self.concat_url(self.auth_uri, "/v2.0/tokens"), "POST",
+            body=self._auth_params())
+        self._store_access(body)
+
+    def _load_cached_access(self):
+        if self.token_cache is not None:
+            access = self.token_cache.get(self)
+            if access is not None and not self._expiring(access):
+                self.access = access
+                return True
+        return False
+
+    def _auth_params(self):
         if self.token:
             params = {"auth": {"token": {"id": self.token}}}
         elif self.username and self.password:
@@ -295,14 +800,97 @@ class HttpClient(object):
             params["auth"]["tenantId"] = self.tenant_id
         elif self.tenant_name:
             params["auth"]["tenantName"] = self.tenant_name
-        resp, body = self.request(
-            self.concat_url(self.auth_uri, "/v2.0/tokens"), "POST",
-            body=params)
+        return params
+
+    def _store_access(self, body):
+        previous = token_expires(self.access)
         try:
             self.access = body["access"]
         except ValueError:
             LOG.error("expected `access' key in keystone response")
             raise
+        expires = token_expires(self.access)
+        if expires is not None and expires == previous:
+            # keystone keeps the expiry of a token issued for a token
+            self._unrenewable_expires = expires
+        if self.token_cache is not None:
+            self.token_cache.put(self, self.access)
+
+    def _expiring(self, access):
+        expires = token_expires(access)
+        if expires is None:
+            return False
+        # NOTE: renewing a token early only pays off if that extends it,
+        #     which takes a password
+        margin = self.refresh_margin
+        if (not (self.username and self.password) or
+                expires == self._unrenewable_expires):
+            margin = 0
+        return expires - margin <= time.time()
+
+    def ensure_authenticated(self, stale_token=None):
+        """Authenticate unless a token that is not about to expire is known.
+
+        A token is renewed `refresh_margin` seconds ahead of its expiry
+        only with password credentials, as long as that yields a later
+        expiry; otherwise it is used until it expires or is rejected.
+
+        Only one thread authenticates at a time; concurrent callers wait for
+        it and then reuse the new token instead of authenticating again.
+
+        :param stale_token: a token rejected by the server; it is replaced
+            even if it has not expired yet
+        """
+        if self._has_valid_token(stale_token):
+            return
+        with self._auth_lock:
+            if not self._has_valid_token(stale_token):
+                self.authenticate()
+
+    def _has_valid_token(self, stale_token=None):
+        access = self.access
+        return bool(access and not self._expiring(access) and
+                    (stale_token is None or
+                     access["token"]["id"] != stale_token))
+
+    def _cache_lookup(self, uri, method, headers, raw=False):
+        """Return the cache entry to revalidate and the headers to send.
+
+        Set `raw` if the body is not read by us and so cannot be cached.
+        """
+        cache = self.http_cache
+        if cache is None or raw:
+            return None, headers
+        if method.upper() != "GET":
+            cache.discard(uri)
+            return None, headers
+        if "If-None-Match" in headers or "If-Modified-Since" in headers:
+            # the caller does its own revalidation
+            return None, headers
+        cached = cache.get(uri, headers.get("X-Auth-Token"))
+        if cached is not None:
+            headers = dict(headers)
+            headers.update(cached.validators())
+        return cached, headers
+
+    def _cache_response(self, uri, method, headers, cached, resp, resp_body):
+        """Return the body to use for `resp` and whether it is cached."""
+        cache = self.http_cache
+        if (cache is None or method.upper() != "GET" or
+                (cached is None and resp_body is None)):
+            return resp_body, False
+        if resp.status == 304 and cached is not None:
+            cache.count(True)
+            return cached.body, True
+        if cached is not None or resp.status == 200:
+            cache.count(False)
+        if resp.status == 200 and resp_body is not None:
+            etag = resp.getheader("etag", None)
+            last_modified = resp.getheader("last-modified", None)
+            if etag or last_modified:
+                cache.put(uri, headers.get("X-Auth-Token"),
+                          etag, last_modified, resp_body)
+        return resp_body, False
 
     def http_log(self, uri, method, headers, body, resp, resp_body):
         if not LOG.isEnabledFor(logging.DEBUG):
@@ -321,6 +909,54 @@ class HttpClient(object):
             LOG.debug("RESP BODY: %s\n" % resp_body)
 
     def request(self, uri, method, **kwargs):
+        """Send an HTTP request and return a (response, body) pair.
+
+        The body is decoded from JSON when possible. Keyword arguments:
+
+        :param params: a dict of query parameters to append to `uri`
+        :param headers: a dict of request headers
+        :param body: a dict or list (sent as JSON), a string, a file-like
+            object or an iterable of chunks
+        :param read_body: if False, do not read a successful response body
+        :param stream: if True, return a successful response body as a
+            :class:`ResponseBodyIterator` over the socket instead of
+            reading it into memory
+        :param retry_policy: a :class:`retry.RetryPolicy` overriding the
+            one of the client for this request, or False to disable retries
+        :param service_type: service type reported to "request_timing" hooks
+        :param compression: overrides the `compression` flag of the client
+        :param chunk_size: size of the chunks a file body is sent in, or
+            "auto" to match the send buffer of the socket
+        :param map_file: if True, send a regular file that sendfile() cannot
+            send from a memory map instead of reading it; the file must not
+            shrink until the request is over
+        :param digest: a hashlib object updated with the file or iterable
+            body as it is sent, or with the response body if `stream`
+
+        A GET answered from the `http_cache` returns the cached body with
+        a :class:`http_cache.RevalidatedResponse`, whose status reads 200.
+        """
+        policy = kwargs.get("retry_policy")
+        if policy is None:
+            policy = self.retry_policy
+        if not policy or not _replayable(kwargs.get("body")):
+            return self._request(uri, method, **kwargs)
+        start = time.time()
+        retries = 0
+        while True:
+            try:
+                return self._request(uri, method, **kwargs)
+            except exceptions.HttpException as e:
+                delay = policy.next_delay(method, e, retries,
+                                          time.time() - start)
+                if delay is None:
+                    raise
+                LOG.warning("%s %s failed with HTTP %s, retrying in %.2fs",
+                            method, uri, e.code, delay)
+                time.sleep(delay)
+                retries += 1
+
+    def _request(self, uri, method, **kwargs):
         params = kwargs.get("params", None)
         if params:
             uri = "?".join(
@@ -329,11 +965,6 @@ class HttpClient(object):
         parsed = urlparse.urlsplit(uri)
         if not parsed.netloc:
             parsed = urlparse.urlparse("http://%s" % uri)
-        use_ssl = parsed.scheme == "https"
-        connection_class = (httplib.HTTPSConnection
-                            if use_ssl
-                            else httplib.HTTPConnection)
-        c = connection_class(parsed.netloc, **self.connect_kwargs)
         request_uri = ("?".join([parsed.path, parsed.query])
                        if parsed.query
                        else parsed.path)
@@ -346,6 +977,17 @@ class HttpClient(object):
             body = json.dumps(body)
         elif body is not None:
             headers["Content-Type"] = "application/octet-stream"
+        compression = kwargs.get("compression")
+        if compression is None:
+            compression = self.compression
+        # NOTE: with read_body=False the caller reads the raw response,
+        #     so it must not get an encoding it did not ask for
+        compression = compression and kwargs.get("read_body", True)
+        if compression:
+            headers.setdefault("Accept-Encoding", "gzip, deflate")
+        cached, headers = self._cache_lookup(
+            uri, method, headers,
+            kwargs.get("stream", False) or not kwargs.get("read_body", True))
 
         def _pushing(method):
             return method.lower() in ("post", "put")
@@ -356,33 +998,93 @@ class HttpClient(object):
         def _filelike(body):
             return hasattr(body, "read")
 
+        timing = None
+        if self._hooks_map.get("request_timing"):
+            timing = {"method": method,
+                      "uri": uri,
+                      "service_type": kwargs.get("service_type"),
+                      "request_bytes": len(body or "") if _simple(body)
+                      else 0}
+            start = time.time()
+
+        digest = kwargs.get("digest")
+
         def _sendbody(connection, iter):
             connection.endheaders()
+            hashed = None
+            if digest is not None:
+                # hash the file while the kernel sends it
+                pool = concurrency.WorkerPool(1)
+                hashed = pool.submit(digest_file, body.fileno(), digest)
+                pool.shutdown(wait=False)
             for sent in iter:
                 # iterator has done the heavy lifting
                 if self.callback:
                     self.callback(len(sent))
+                if timing is not None:
+                    timing["request_bytes"] += len(sent)
+            if hashed is not None:
+                hashed.result()
 
         def _chunkbody(connection, iter):
             connection.putheader("Transfer-Encoding", "chunked")
             connection.endheaders()
-            for chunk in iter:
-                connection.send("%x\r\n%s\r\n" % (len(chunk), chunk))
-                if self.callback:
-                    self.callback(len(chunk))
-            connection.send("0\r\n\r\n")
+            # the framing is sent apart so that chunks are never copied;
+            # corking merges both into full segments
+            set_cork(connection.sock, True)
+            try:
+                framing = "%x\r\n"
+                for chunk in iter:
+                    if not len(chunk):
+                        # an empty chunk would end the body
+                        continue
+                    connection.send(framing % len(chunk))
+                    send_all(connection.sock, chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+                    # the CRLF ending a chunk goes with the next size line
+                    framing = "\r\n%x\r\n"
+                    if self.callback:
+                        self.callback(len(chunk))
+                    if timing is not None:
+                        timing["request_bytes"] += len(chunk)
+                connection.send(framing % 0 + "\r\n")
+            finally:
+                set_cork(connection.sock, False)
+
+        def _timing_sent(c, reused, sent):
+            connect_timings = {} if reused else (c.timings or {})
+            timing["reused"] = reused
+            for key in "dns", "connect", "tls":
+                timing[key] = connect_timings.get(key, 0)
+            timing["ttfb"] = (time.time() - sent - (timing["dns"] or 0) -
+                              timing["connect"] - (timing["tls"] or 0))
+            timing["status"] = resp.status
+
+        def _timing_done(received, response_bytes, wire_bytes, decode=0):
+            now = time.time()
+            timing["transfer"] = now - received - decode
+            timing["decode"] = decode
+            timing["response_bytes"] = response_bytes
+            timing["wire_bytes"] = wire_bytes
+            timing["total"] = now - start
+            self.run_hooks("request_timing", timing)
 
         # Do a simple request or a chunked request, depending
         # on whether the body param is file-like or iterable and
         # the method is PUT or POST
         #
-        try:
-            resp, resp_body = None, None
+        def _send(c):
+            c.request_sent = False
             if not _pushing(method) or _simple(body):
                 # Simple request...
                 c.request(method, request_uri, body, headers)
             else:
-                iter = body_iterator(c, body)
+                chunk_size = kwargs.get("chunk_size") or CHUNKSIZE
+                if chunk_size == "auto":
+                    chunk_size = auto_chunk_size(c)
+                iter = body_iterator(c, body, chunk_size,
+                                     kwargs.get("map_file", False))
                 if iter is None:
                     raise TypeError(
                         "Unsupported body type: %s" % body.__class__)
@@ -402,21 +1104,97 @@ class HttpClient(object):
                 else:
                     # otherwise iterate and chunk
                     _chunkbody(c, iter)
+            return c.getresponse()
 
-            resp = c.getresponse()
+        pool = self.connection_pool
+        try:
+            resp, resp_body = None, None
+            c, reused = pool.get(parsed.scheme, parsed.netloc)
+            sent = time.time()
+            try:
+                resp = _send(c)
+            except (socket.error, httplib.HTTPException) as e:
+                c.close()
+                # NOTE: a pooled connection may be closed by the server
+                # between our staleness check and the request; replay on
+                # a fresh connection if the body can be sent again and the
+                # server cannot have acted on the request already. After
+                # a timeout it may well have, so that is never replayed.
+                if (not reused or not _simple(body) or
+                        isinstance(e, socket.timeout) or
+                        (c.request_sent and method.upper() not in
+                         retry.RetryPolicy.IDEMPOTENT_METHODS)):
+                    raise
+                c = pool.new_connection(parsed.scheme, parsed.netloc)
+                reused = False
+                sent = time.time()
+                resp = _send(c)
             status_class = resp.status / 100
-            if status_class != 2 or kwargs.get("read_body", True):
-                resp_body = resp.read()
+            if timing is not None:
+                _timing_sent(c, reused, sent)
+            received = time.time()
+
+            def _release(reusable=True):
+                if reusable and not resp.will_close:
+                    pool.put(parsed.scheme, parsed.netloc, c)
+                else:
+                    c.close()
+                if timing is not None and stream is not None:
+                    _timing_done(received, stream.bytes_decoded,
+                                 stream.bytes_read)
+
+            decompressor = None
+            if compression:
+                decompressor = Decompressor.for_response(resp)
+            stream = None
+            wire_bytes = 0
+            if status_class == 2 and kwargs.get("stream", False):
+                # the connection goes back to the pool when the caller
+                # has exhausted the iterator
+                stream = ResponseBodyIterator(resp, _release,
+                                              decompressor=decompressor,
+                                              digest=digest)
+            elif status_class != 2 or kwargs.get("read_body", True):
+                try:
+                    resp_body = resp.read()
+                except Exception:
+                    _release(False)
+                    raise
+                wire_bytes = len(resp_body)
+                _release()
+                if decompressor is not None and resp_body:
+                    try:
+                        resp_body = (decompressor.decompress(resp_body) +
+                                     decompressor.flush())
+                    except zlib.error as e:
+                        raise decompressor.error(e)
             else:
+                # the caller owns the connection until it reads the body
                 resp_body = None
         finally:
             self.http_log(uri, method, headers, body, resp, resp_body)
 
+        if stream is not None:
+            return (resp, stream)
+
+        resp_body, revalidated = self._cache_response(
+            uri, method, headers, cached, resp, resp_body)
+        if revalidated:
+            # a 304 is answered from the cache, not followed
+            status_class = 2
+            resp = http_cache.RevalidatedResponse(resp)
+
+        if timing is not None:
+            response_bytes = len(resp_body or "")
+            decoding = time.time()
         try:
             if resp_body:
                 resp_body = json.loads(resp_body)
         except (TypeError, ValueError):
             pass
+        if timing is not None:
+            _timing_done(received, response_bytes, wire_bytes,
+                         time.time() - decoding)
 
         if status_class == 3 and not _pushing(method):
             return self.request(resp["location"], method, **kwargs)
@@ -445,24 +1223,28 @@ class HttpClient(object):
             return "%s/%s" % (endpoint, url)
 
     def cs_request(self, client, url, method, **kwargs):
+        """Send an authenticated request to the endpoint of `client`.
+
+        Keyword arguments are passed to :meth:`request`, so
+        ``client.get(url, stream=True)`` returns a body iterator.
+        """
         if self.endpoint:
             endpoint = self.endpoint
             token = self.token
         else:
-            if not self.access:
-                self.authenticate()
-                client.endpoint = None
+            self.ensure_authenticated()
+            access = self.access
             endpoint = self.url_for(
                 client.endpoint_type,
                 client.service_type)
-            if not client.endpoint:
-                client.endpoint = endpoint
-            token = self.access["token"]["id"]
+            client.endpoint = endpoint
+            token = access["token"]["id"]
 
         kwargs.setdefault("headers", {})
         kwargs["headers"]["X-Auth-Token"] = token
+        kwargs.setdefault("service_type", client.service_type)
         # Perform the request once. If we get a 401 back then it
-        # might be because the auth token expired, so try to
+        # might be because the auth token was revoked, so try to
         # re-authenticate and try again. If it still fails, bail.
         try:
             return self.request(
@@ -470,16 +1252,87 @@ class HttpClient(object):
         except exceptions.Unauthorized:
             if self.endpoint:
                 raise
-            self.authenticate()
+            if self.token_cache is not None:
+                self.token_cache.discard(self, token)
+            self.ensure_authenticated(stale_token=token)
+            access = self.access
             endpoint = self.url_for(
                 client.endpoint_type,
                 client.service_type)
             client.endpoint = endpoint
-            token = self.access["token"]["id"]
+            token = access["token"]["id"]
             kwargs["headers"]["X-Auth-Token"] = token
             return self.request(
                 self.concat_url(endpoint, url), method, **kwargs)
 
+    def map(self, requests, max_workers=8):
+        """Send several authenticated requests concurrently.
+
+        :param requests: an iterable of (client, url, method) or
+            (client, url, method, kwargs) tuples, as for :meth:`cs_request`
+        :param max_workers: maximum number of requests in flight; keep it
+            within `pool_maxsize` so that each worker reuses a connection
+        :returns: a list holding, for each request in order, either its
+            (resp, body) pair or the exception it raised
+        """
+        calls = [(self.cs_request, (client, url, method), kwargs)
+                 for client, url, method, kwargs
+                 in self._expand_requests(requests)]
+        return concurrency.run_all(calls, max_workers)
+
+    @staticmethod
+    def _expand_requests(requests):
+        for request in requests:
+            client, url, method = request[:3]
+            kwargs = dict(request[3]) if len(request) > 3 else {}
+            # cs_request adds the token to the headers of each request
+            kwargs["headers"] = dict(kwargs.get("headers") or {})
+            yield client, url, method, kwargs
+
+
+class Batch(object):
+    """
+    Collect requests to a client and send them concurrently.
+
+    Usage::
+
+        batch = client.batch()
+        for server_id in server_ids:
+            batch.delete("/servers/%s" % server_id)
+        for result in batch.execute(max_workers=16):
+            if isinstance(result, Exception):
+                ...
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+
+    def add(self, url, method, **kwargs):
+        """Queue a request and return its index in the results."""
+        self.requests.append((self.client, url, method, kwargs))
+        return len(self.requests) - 1
+
+    def head(self, url, **kwargs):
+        return self.add(url, "HEAD", **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.add(url, "GET", **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.add(url, "POST", **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.add(url, "PUT", **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.add(url, "DELETE", **kwargs)
+
+    def execute(self, max_workers=8):
+        """Send the queued requests; see :meth:`HttpClient.map`."""
+        requests, self.requests = self.requests, []
+        return self.client.http_client.map(requests, max_workers)
+
 
 class BaseClient(object):
     """
@@ -506,6 +1359,10 @@ class BaseClient(object):
         return self.http_client.cs_request(
             self, url, method, **kwargs)
 
+    def batch(self):
+        """Return a :class:`Batch` of concurrent requests to this client."""
+        return Batch(self)
+
     def head(self, url, **kwargs):
         return self.cs_request(url, "HEAD", **kwargs)
 
@@ -43,6 +43,13 @@ class UserKeypairManager(base.Manager):
         return self._list('/gd-userinfo/%s/keypairs' % base.getid(user),
                           'keypairs')
 
+    def iter(self, user):
+        """
+        Iterate over the keypairs of a user, fetching them page by page.
+        """
+        return self._iter_list('/gd-userinfo/%s/keypairs' % base.getid(user),
+                               'keypairs')
+
     def get(self, user, key):
         """
         Get specific keypair for a user
@@ -0,0 +1,234 @@
+# Copyright 2013 Grid Dynamics.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A minimal thread pool to run independent API calls concurrently.
+"""
+
+import Queue
+import sys
+import threading
+
+
+class Future(object):
+    """
+    The eventual result of a call submitted to a :class:`WorkerPool`.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.done()
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the call, or None."""
+        self.wait(timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def result(self, timeout=None):
+        """Return the result of the call or re-raise its exception."""
+        if not self.wait(timeout):
+            raise RuntimeError("Future is not done")
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of daemon threads running submitted calls in FIFO order.
+
+    Threads are started on demand, up to `max_workers`.
+
+    Usage::
+
+        with WorkerPool(8) as pool:
+            futures = [pool.submit(client.get, url) for url in urls]
+        results = [f.result() for f in futures]
+    """
+
+    def __init__(self, max_workers=8):
+        if max_workers < 1:
+            raise ValueError("max_workers must be positive")
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            with self._lock:
+                self._idle -= 1
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                future.set_exc_info(sys.exc_info())
+            else:
+                future.set_result(result)
+            with self._lock:
+                self._idle += 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule ``fn(*args, **kwargs)`` and return its :class:`Future`.
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            if (self._queue.qsize() >= self._idle and
+                    len(self._threads) < self.max_workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                self._threads.append(thread)
+                self._idle += 1
+                thread.start()
+            self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """Stop the threads once all submitted calls are done."""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = list(self._threads)
+        for thread in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True)
+        return False
+
+
+def run_all(calls, max_workers=8):
+    """Run calls concurrently and return their outcomes in order.
+
+    :param calls: an iterable of (fn, args, kwargs) tuples
+    :param max_workers: maximum number of calls running at the same time
+    :returns: a list holding, for each call, either its result or the
+        exception it raised
+    """
+    with WorkerPool(max_workers) as pool:
+        futures = [pool.submit(fn, *args, **kwargs)
+                   for fn, args, kwargs in calls]
+    outcomes = []
+    for future in futures:
+        error = future.exception()
+        outcomes.append(error if error is not None else future.result())
+    return outcomes
+
+
+class Prefetcher(object):
+    """
+    Iterate over `iterable` in a background thread.
+
+    Up to `depth` items are produced ahead of the consumer. An exception
+    raised by `iterable` is re-raised to the consumer in order; close()
+    stops the producer after its current item.
+
+    Usage::
+
+        for page in Prefetcher(fetch_pages(), 2):
+            process(page)
+    """
+
+    def __init__(self, iterable, depth=1):
+        self._items = Queue.Queue(max(depth, 1))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce,
+                                        args=(iterable,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, entry):
+        while not self._stop.is_set():
+            try:
+                self._items.put(entry, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put((True, item)):
+                    return
+        except BaseException:
+            self._put((False, sys.exc_info()))
+        else:
+            self._put((False, None))
+
+    def __iter__(self):
+        try:
+            while True:
+                ok, value = self._items.get()
+                if ok:
+                    yield value
+                elif value is not None:
+                    raise value[0], value[1], value[2]
+                else:
+                    return
+        finally:
+            self.close()
+
+    def close(self, wait=False):
+        """Stop the producer, waiting for its current item if `wait`."""
+        self._stop.set()
+        if wait:
+            self._thread.join()
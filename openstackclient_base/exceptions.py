@@ -35,14 +35,26 @@ class ClientConnectionError(ClientException):
     pass
 
 
+class ChecksumMismatch(ClientException):
+    """The data transferred does not match the checksum of the server."""
+    def __init__(self, expected, actual):
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        return "Checksum mismatch: expected %s, got %s" % (self.expected,
+                                                          self.actual)
+
+
 class HttpException(ClientException):
     """
     The base exception class for all exceptions this library raises.
     """
-    def __init__(self, code, message=None, details=None):
+    def __init__(self, code, message=None, details=None, retry_after=None):
         self.code = code
         self.message = message or self.__class__.message
         self.details = details
+        self.retry_after = retry_after
 
     def __str__(self):
         return "%s (HTTP %s)" % (self.message, self.code)
@@ -132,6 +144,7 @@ def from_response(response, body):
             raise exception_from_response(resp, body)
     """
     cls = _code_map.get(response.status, HttpException)
+    retry_after = response.getheader("retry-after", None)
     if body:
         if isinstance(body, dict):
             error = body.itervalues().next() if body else {}
@@ -142,6 +155,7 @@ def from_response(response, body):
         else:
             message = "Unable to communicate with server: %s." % body
             details = None
-        return cls(code=response.status, message=message, details=details)
+        return cls(code=response.status, message=message, details=details,
+                   retry_after=retry_after)
     else:
-        return cls(code=response.status)
+        return cls(code=response.status, retry_after=retry_after)
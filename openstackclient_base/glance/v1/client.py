@@ -14,12 +14,14 @@
 #    under the License.
 
 from openstackclient_base.client import BaseClient
+from openstackclient_base import base
+from openstackclient_base import exceptions
+from openstackclient_base import transfer
 
 from glanceclient.v1 import images
 from glanceclient.v1 import image_members
 
 
-
 class ImageClient(BaseClient):
     """
     Client for the OpenStack Images v1 API.
@@ -33,3 +35,94 @@ class ImageClient(BaseClient):
 
         self.images = images.ImageManager(self)
         self.image_members = image_members.ImageMemberManager(self)
+
+    @staticmethod
+    def _meta_headers(meta):
+        headers = {}
+        for key, value in (meta or {}).iteritems():
+            if key == "properties":
+                for prop, prop_value in value.iteritems():
+                    headers["x-image-meta-property-%s" % prop] = prop_value
+            else:
+                headers["x-image-meta-%s" % key] = value
+        return headers
+
+    @staticmethod
+    def _verify(done, expected):
+        if expected and done.checksum != expected:
+            raise exceptions.ChecksumMismatch(expected, done.checksum)
+
+    def upload(self, source, image=None, meta=None, attempts=1,
+               verify=False, **kwargs):
+        """
+        Upload image data, reading it ahead in a background thread.
+
+        Glance v1 cannot resume a partial upload, so a failed upload is
+        started over from the beginning of a seekable source, up to
+        `attempts` times in all.
+
+        :param source: a path, a file-like object or a
+            :class:`transfer.Upload`
+        :param image: the queued image (or its ID) to upload data to;
+            a new image is created if None
+        :param meta: image metadata, e.g. {"name": ..., "disk_format": ...,
+            "properties": {...}}
+        :param verify: compute the MD5 of the data while it is sent and
+            raise :class:`exceptions.ChecksumMismatch` if it differs from
+            the checksum stored by the server
+        :param kwargs: passed to :class:`transfer.Upload`, e.g. `callback`
+            to follow the progress, or `map_file` to send a regular file
+            from a memory map (it must not shrink meanwhile)
+        :rtype: dict of the image metadata returned by the server
+        """
+        upload = source
+        if not isinstance(upload, transfer.Upload):
+            upload = transfer.Upload(source, **kwargs)
+        if verify:
+            upload.digest_name = "md5"
+        headers = self._meta_headers(meta)
+        headers["Content-Type"] = "application/octet-stream"
+        if upload.size is not None:
+            headers["x-image-meta-size"] = upload.size
+        if image is None:
+            url, method = "/v1/images", "POST"
+        else:
+            url = "/v1/images/%s" % base.getid(image)
+            method = "PUT"
+        try:
+            resp, body = transfer.send(self, url, upload, method, headers,
+                                       attempts)
+        finally:
+            if upload is not source:
+                upload.close()
+        if verify:
+            self._verify(upload, body["image"].get("checksum"))
+        return body["image"]
+
+    def download(self, image, dest, verify=False, **kwargs):
+        """
+        Download image data to a file, avoiding copies in user space.
+
+        The file is preallocated to the size announced by the server.
+
+        :param image: the image (or its ID) to download
+        :param dest: a path, a file descriptor, a file object or a
+            :class:`transfer.Download`
+        :param verify: compute the MD5 of the data while it is received
+            and raise :class:`exceptions.ChecksumMismatch` if it differs
+            from the checksum of the image
+        :param kwargs: passed to :class:`transfer.Download`, e.g.
+            `callback` to follow the progress
+        :rtype: :class:`transfer.Download`
+        """
+        if verify:
+            if isinstance(dest, transfer.Download):
+                dest.digest_name = "md5"
+            else:
+                kwargs["digest"] = "md5"
+        resp, download = transfer.download(
+            self, "/v1/images/%s" % base.getid(image), dest, **kwargs)
+        if verify:
+            self._verify(download,
+                         resp.getheader("x-image-meta-checksum", None))
+        return download
@@ -0,0 +1,123 @@
+# Copyright 2013 Grid Dynamics.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Revalidation cache of GET responses carrying an ETag or Last-Modified.
+"""
+
+import collections
+import threading
+
+
+class CacheEntry(object):
+    """
+    A response body with the validators to check it is still current.
+    """
+
+    def __init__(self, etag, last_modified, body):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+
+    def validators(self):
+        """Return the conditional request headers for this entry."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class RevalidatedResponse(object):
+    """
+    A 304 response standing for the cached 200 response it revalidated.
+
+    It reads status 200 and has `from_cache` set; everything else,
+    headers included, comes from the 304 response.
+    """
+
+    status = 200
+    reason = "OK"
+    from_cache = True
+
+    def __init__(self, resp):
+        self.resp = resp
+
+    def __getattr__(self, name):
+        return getattr(self.resp, name)
+
+    def __getitem__(self, name):
+        return self.resp[name]
+
+
+class HttpCache(object):
+    """
+    Keep the bodies of GET responses to serve them again on 304.
+
+    Entries are keyed by URL and auth token, so that a body is never
+    shared between tokens, and evicted in least recently used order once
+    there are more than `maxsize` of them or their bodies exceed
+    `max_bytes`. A PUT, POST or DELETE to a URL drops its entries.
+
+    Usage::
+
+        http_client = HttpClient(..., http_cache=HttpCache())
+    """
+
+    def __init__(self, maxsize=1000, max_bytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.counters = {"hits": 0, "misses": 0}
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uri, token):
+        with self._lock:
+            entry = self._entries.pop((uri, token), None)
+            if entry is not None:
+                self._entries[(uri, token)] = entry
+            return entry
+
+    def put(self, uri, token, etag, last_modified, body):
+        entry = CacheEntry(etag, last_modified, body)
+        with self._lock:
+            old = self._entries.pop((uri, token), None)
+            if old is not None:
+                self.size -= len(old.body)
+            if len(body) > self.max_bytes:
+                return
+            self._entries[(uri, token)] = entry
+            self.size += len(body)
+            while (len(self._entries) > self.maxsize or
+                   self.size > self.max_bytes):
+                key, old = self._entries.popitem(last=False)
+                self.size -= len(old.body)
+
+    def count(self, hit):
+        with self._lock:
+            self.counters["hits" if hit else "misses"] += 1
+
+    def discard(self, uri):
+        """Drop the entries of `uri` for all tokens."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == uri]:
+                self.size -= len(self._entries.pop(key).body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
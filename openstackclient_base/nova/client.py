@@ -42,6 +42,9 @@ class ComputeClient(BaseClient):
         self.images = images.ImageManager(self)
         self.limits = limits.LimitsManager(self)
         self.servers = servers.ServerManager(self)
+        self.servers.filter_attrs = ("name", "status")
+        self.servers.regex_filter_attrs = ("name",)
+        self.servers.detail_listing = ("/servers/detail", "servers")
 
         # extensions
         self.dns_domains = floating_ip_dns.FloatingIPDNSDomainManager(self)
@@ -32,6 +32,14 @@ class NetworkManager(base.ManagerWithFind):
         """
         return self._list("/gd-networks", "networks")
 
+    def iter(self):
+        """
+        Iterate over all networks, fetching them page by page.
+
+        :rtype: iterator of :class:`Network`.
+        """
+        return self._iter_list("/gd-networks", "networks")
+
     def get(self, network):
         """
         Get a specific network.
@@ -76,7 +84,10 @@ class NetworkManager(base.ManagerWithFind):
         body = {
             "network": kwargs
         }
-        resp, body = self.api.post("/gd-networks", body=body)
+        try:
+            resp, body = self.api.post("/gd-networks", body=body)
+        finally:
+            self.invalidate()
         return [self.resource_class(self, item) for item in body["networks"]]
 
     def disassociate(self, network):
@@ -85,8 +96,11 @@ class NetworkManager(base.ManagerWithFind):
 
         :param network: The ID of the :class:`Network` to get.
         """
-        self.api.post("/gd-networks/%s/action" % base.getid(network),
-                      body={"disassociate": 1})
+        try:
+            self.api.post("/gd-networks/%s/action" % base.getid(network),
+                          body={"disassociate": 1})
+        finally:
+            self.invalidate()
 
     def associate(self, network, project):
         """
@@ -94,8 +108,31 @@ class NetworkManager(base.ManagerWithFind):
 
         :param project: The ID of the :class:`Network` to get.
         """
-        self.api.post("/gd-networks/%s/action" % base.getid(network),
-                      body={"associate": base.getid(project)})
+        try:
+            self.api.post("/gd-networks/%s/action" % base.getid(network),
+                          body={"associate": base.getid(project)})
+        finally:
+            self.invalidate()
+
+    def disassociate_many(self, networks, max_workers=8,
+                          stop_on_error=False):
+        """
+        Disassociate many networks from their projects concurrently.
+
+        :rtype: :class:`BulkResult`
+        """
+        return self._run_many(self.disassociate, networks, max_workers,
+                              stop_on_error)
+
+    def associate_many(self, pairs, max_workers=8, stop_on_error=False):
+        """
+        Associate networks with projects concurrently.
+
+        :param pairs: (network, project) tuples
+        :rtype: :class:`BulkResult`
+        """
+        return self._run_many(self.associate, pairs, max_workers,
+                              stop_on_error)
 
 
 manager_class = NetworkManager
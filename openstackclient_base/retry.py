@@ -0,0 +1,113 @@
+# Copyright 2013 Grid Dynamics.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Retry policy for requests rejected with OverLimit or a server error.
+"""
+
+import email.utils
+import random
+import threading
+import time
+
+from openstackclient_base import exceptions
+
+
+def parse_retry_after(value, now=None):
+    """Return the delay in seconds requested by a Retry-After header.
+
+    Both the delta-seconds and the HTTP-date forms are accepted; None is
+    returned for a missing or malformed value.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0, email.utils.mktime_tz(parsed) - now)
+
+
+class RetryPolicy(object):
+    """
+    Retry idempotent requests with exponential backoff and full jitter.
+
+    The n-th retry waits a random time up to ``backoff * 2 ** n`` seconds
+    (capped by `max_backoff`), or the delay asked for by the server's
+    Retry-After header. No retry starts past `total_timeout` seconds from
+    the first attempt.
+
+    Usage::
+
+        http_client = HttpClient(..., retry_policy=RetryPolicy())
+        # per-request override, False disables retries
+        client.get(url, retry_policy=RetryPolicy(max_retries=10))
+
+    :param max_retries: maximum number of retries after the first attempt
+    :param backoff: base delay in seconds
+    :param max_backoff: maximum delay in seconds between two attempts
+    :param total_timeout: time budget in seconds for all attempts
+    :param statuses: HTTP statuses worth retrying
+    :param methods: HTTP methods safe to send again
+    """
+
+    RETRY_STATUSES = (413, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+    def __init__(self, max_retries=5, backoff=0.5, max_backoff=30,
+                 total_timeout=120, statuses=None, methods=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.total_timeout = total_timeout
+        self.statuses = frozenset(statuses or self.RETRY_STATUSES)
+        self.methods = frozenset(m.upper()
+                                 for m in methods or self.IDEMPOTENT_METHODS)
+        self.counters = {"failures": 0, "retries": 0, "gave_up": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def retryable(self, method, error):
+        return (method.upper() in self.methods and
+                isinstance(error, exceptions.HttpException) and
+                error.code in self.statuses)
+
+    def next_delay(self, method, error, retries, elapsed):
+        """Return how long to sleep before retrying, or None to give up.
+
+        :param retries: number of retries done so far
+        :param elapsed: seconds since the first attempt
+        """
+        self._count("failures")
+        if not self.retryable(method, error):
+            return None
+        delay = parse_retry_after(getattr(error, "retry_after", None))
+        if delay is None:
+            delay = random.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** retries))
+        if (retries >= self.max_retries or
+                (self.total_timeout is not None and
+                 elapsed + delay > self.total_timeout)):
+            self._count("gave_up")
+            return None
+        self._count("retries")
+        return delay
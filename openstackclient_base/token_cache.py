@@ -0,0 +1,132 @@
+# Copyright 2013 Grid Dynamics.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+On-disk cache of keystone tokens and service catalogs.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from openstackclient_base import client
+
+
+LOG = logging.getLogger(__name__)
+
+
+class TokenCache(object):
+    """
+    Share keystone ``access`` structures between processes through files.
+
+    Each entry is stored in its own file named after a hash of the auth URI,
+    the credentials and the tenant. Files are replaced atomically with
+    rename(), so concurrent writers never leave a torn entry behind: the
+    last one wins and readers always see a complete token.
+
+    Usage::
+
+        http_client = HttpClient(..., token_cache=TokenCache())
+
+    :param path: cache directory (created with 0700 permissions)
+    :param margin: entries expiring within this many seconds are ignored
+    """
+
+    def __init__(self, path=None, margin=60):
+        self.path = path or os.path.expanduser(
+            "~/.cache/openstackclient-base/tokens")
+        self.margin = margin
+
+    @staticmethod
+    def key(http_client):
+        """Return the cache key of the credentials of `http_client`."""
+        secret = http_client.password or http_client.token or ""
+        if isinstance(secret, unicode):
+            secret = secret.encode("utf-8")
+        parts = [http_client.auth_uri,
+                 http_client.username,
+                 hashlib.sha256(secret).hexdigest(),
+                 http_client.tenant_id,
+                 http_client.tenant_name]
+        return hashlib.sha256(json.dumps(parts)).hexdigest()
+
+    def _filename(self, http_client):
+        return os.path.join(self.path, self.key(http_client))
+
+    def get(self, http_client):
+        """Return a cached ``access`` if it is not about to expire."""
+        try:
+            with open(self._filename(http_client)) as f:
+                access = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        expires = client.token_expires(access)
+        if expires is None or expires - self.margin <= time.time():
+            return None
+        return access
+
+    def put(self, http_client, access):
+        """Store `access` unless it has no usable ``expires`` field."""
+        expires = client.token_expires(access)
+        if expires is None or expires - self.margin <= time.time():
+            return
+        try:
+            os.makedirs(self.path, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                LOG.warning("cannot create token cache %s: %s", self.path, e)
+                return
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".tmp")
+        except (IOError, OSError) as e:
+            LOG.warning("cannot write token cache %s: %s", self.path, e)
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(access, f)
+            os.rename(tmp_name, self._filename(http_client))
+        except (IOError, OSError) as e:
+            LOG.warning("cannot write token cache %s: %s", self.path, e)
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+
+    def discard(self, http_client, token_id=None):
+        """Remove the entry of `http_client`.
+
+        If `token_id` is given, the entry is removed only if it still holds
+        that token, so a fresher one written by another process survives.
+        """
+        filename = self._filename(http_client)
+        if token_id is not None:
+            try:
+                with open(filename) as f:
+                    if json.load(f)["token"]["id"] != token_id:
+                        return
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                pass
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
@@ -0,0 +1,429 @@
+# Copyright 2013 Grid Dynamics.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Bulk data transfers with progress and throughput reporting.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import hashlib
+import httplib
+import logging
+import os
+import select
+import socket
+import ssl
+import stat
+import time
+
+from openstackclient_base import client
+from openstackclient_base import concurrency
+
+
+LOG = logging.getLogger(__name__)
+
+# NOTE: splice() and posix_fallocate() are reached through ctypes; either
+#     may be missing, in which case the portable paths are used
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except OSError:
+    _libc = None
+
+_splice = getattr(_libc, "splice", None)
+if _splice is not None:
+    _splice.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                        ctypes.c_int, ctypes.c_void_p,
+                        ctypes.c_size_t, ctypes.c_uint]
+    _splice.restype = ctypes.c_ssize_t
+SPLICE_F_MOVE = 1
+SPLICE_F_MORE = 4
+# the default capacity of a Linux pipe
+PIPE_SIZE = 65536
+
+_fallocate = getattr(_libc, "posix_fallocate", None)
+if _fallocate is not None:
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    _fallocate.restype = ctypes.c_int
+
+
+def preallocate(fd, size):
+    """Reserve `size` bytes for the file open as `fd`."""
+    if _fallocate is not None:
+        if _fallocate(fd, 0, size) == 0:
+            return
+    # NOTE: a sparse file at least avoids growing it chunk by chunk
+    os.ftruncate(fd, size)
+
+
+def _write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _wait_readable(sock):
+    timeout = sock.gettimeout()
+    if not select.select([sock], [], [], timeout)[0]:
+        raise socket.timeout("timed out")
+
+
+def _splice_all(sock, fd, length, advance):
+    """Move `length` bytes from `sock` to `fd` through a pipe.
+
+    Returns the number of bytes moved, which is less than `length` only
+    if the kernel refuses to splice the socket or the file.
+    """
+    done = 0
+    pipe_r, pipe_w = os.pipe()
+    try:
+        while done < length:
+            count = _splice(sock.fileno(), None, pipe_w, None,
+                            min(length - done, PIPE_SIZE),
+                            SPLICE_F_MOVE | SPLICE_F_MORE)
+            if count < 0:
+                err = ctypes.get_errno()
+                if err == errno.EAGAIN:
+                    _wait_readable(sock)
+                    continue
+                if err == errno.EINTR:
+                    continue
+                if done == 0 and err in (errno.EINVAL, errno.ENOSYS):
+                    return 0
+                raise OSError(err, os.strerror(err))
+            if count == 0:
+                raise httplib.IncompleteRead("", length - done)
+            left = count
+            while left:
+                moved = _splice(pipe_r, None, fd, None, left, SPLICE_F_MOVE)
+                if moved < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    if err in (errno.EINVAL, errno.ENOSYS):
+                        # the file does not take splice(): copy what the
+                        # pipe holds and let the caller go on reading
+                        while left:
+                            data = os.read(pipe_r, left)
+                            _write_all(fd, data)
+                            left -= len(data)
+                        advance(count)
+                        return done + count
+                    raise OSError(err, os.strerror(err))
+                left -= moved
+            done += count
+            advance(count)
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+    return done
+
+
+def _recv_all(sock, fd, length, buf, advance, digest=None):
+    """Copy `length` bytes from `sock` to `fd` through the buffer `buf`."""
+    view = memoryview(buf)
+    while length:
+        count = sock.recv_into(view, min(length, len(buf)))
+        if not count:
+            raise httplib.IncompleteRead("", length)
+        if digest is not None:
+            digest.update(view[:count])
+        _write_all(fd, view[:count])
+        length -= count
+        advance(count)
+
+
+class Transfer(object):
+    """
+    Progress of a data transfer.
+
+    `callback`, if given, is called with the transfer after every chunk.
+    If `digest` names a hashlib algorithm, the data is hashed on the way
+    and `checksum` holds its hex digest.
+    """
+
+    def __init__(self, size=None, callback=None, digest=None):
+        self.size = size
+        self.callback = callback
+        self.digest_name = digest
+        self.digest = None
+        self.bytes_done = 0
+        self.started = None
+        self.finished = None
+
+    def _start(self):
+        self.bytes_done = 0
+        self.started = time.time()
+        self.finished = None
+        if self.digest_name:
+            self.digest = hashlib.new(self.digest_name)
+
+    def _advance(self, length):
+        self.bytes_done += length
+        if self.callback:
+            self.callback(self)
+
+    def _finish(self):
+        self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """Average rate in bytes per second."""
+        elapsed = self.elapsed
+        return self.bytes_done / elapsed if elapsed else 0
+
+    @property
+    def checksum(self):
+        if self.digest is None:
+            return None
+        return self.digest.hexdigest()
+
+    @property
+    def percent(self):
+        """Percentage done, or None if the size is unknown."""
+        if not self.size:
+            return None
+        return 100.0 * self.bytes_done / self.size
+
+
+class Upload(Transfer):
+    """
+    A request body read from a file by a background thread.
+
+    Reading runs ahead of the socket by up to `depth` chunks, so disk and
+    network I/O overlap; so does hashing, done by the reading thread.
+    `source` is a path or a file-like object; the size of regular files
+    is found out if not given.
+
+    With `map_file`, a regular file is sent from a memory map instead,
+    which saves copying it over HTTPS, where sendfile() cannot be used.
+    The file must then not shrink until the upload is over: reading a
+    mapped page past its new end raises SIGBUS, which kills the process.
+
+    Usage::
+
+        upload = Upload("/path/to/image", callback=report)
+        client.put(url, body=upload)
+        print upload.throughput
+    """
+
+    def __init__(self, source, size=None, chunk_size=client.CHUNKSIZE,
+                 depth=4, callback=None, digest=None, map_file=False):
+        self._owned = isinstance(source, basestring)
+        if self._owned:
+            source = open(source, "rb")
+        if size is None:
+            try:
+                st = os.fstat(source.fileno())
+                if stat.S_ISREG(st.st_mode):
+                    size = st.st_size
+            except (AttributeError, IOError, OSError):
+                pass
+        super(Upload, self).__init__(size, callback, digest)
+        self.source = source
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self.map_file = map_file
+        self._chunks = None
+
+    def _read(self):
+        digest = self.digest
+        for chunk in iter(lambda: self.source.read(self.chunk_size), ""):
+            if digest is not None:
+                digest.update(chunk)
+            yield chunk
+
+    def __iter__(self):
+        self._start()
+        if self.map_file and client.mappable(self.source):
+            for chunk in client.MmapIterator(self.source, self.chunk_size):
+                if self.digest is not None:
+                    self.digest.update(chunk)
+                yield chunk
+                self._advance(len(chunk))
+            self._finish()
+            return
+        self._chunks = concurrency.Prefetcher(self._read(), self.depth)
+        for chunk in self._chunks:
+            yield chunk
+            self._advance(len(chunk))
+        self._finish()
+
+    def rewind(self):
+        """Go back to the start of the source, if it can seek."""
+        if self._chunks is not None:
+            # the reader thread must not move the file position anymore
+            self._chunks.close(wait=True)
+            self._chunks = None
+        try:
+            self.source.seek(0)
+        except (AttributeError, IOError, OSError):
+            return False
+        self.bytes_done = 0
+        return True
+
+    def close(self):
+        if self._chunks is not None:
+            # the reader thread must be done with a file closed here
+            self._chunks.close(wait=self._owned)
+            self._chunks = None
+        if self._owned:
+            self.source.close()
+
+
+def send(api, url, upload, method="PUT", headers=None, attempts=1):
+    """Send `upload` as the body of a request through `api`.
+
+    A request failing at the connection level is started over, up to
+    `attempts` times in all, if the upload can be rewound.
+
+    :param api: a :class:`client.BaseClient`
+    :returns: a (response, body) pair
+    """
+    attempt = 1
+    while True:
+        try:
+            return api.cs_request(url, method, body=upload,
+                                  headers=dict(headers or {}))
+        except (socket.error, httplib.HTTPException) as e:
+            sent = upload.bytes_done
+            if attempt >= attempts or not upload.rewind():
+                raise
+            LOG.warning("upload to %s failed after %s bytes (%s), "
+                        "starting over", url, sent, e)
+            attempt += 1
+
+
+class Download(Transfer):
+    """
+    A response body written to a file with as little copying as possible.
+
+    The file is preallocated to the expected size. Plain HTTP bodies of
+    known length are moved from the socket to the file by the kernel with
+    splice() on Linux, other sockets are read into a single reusable
+    buffer with recv_into(); chunked or compressed bodies are written as
+    they are read. Hashing needs the data in user space, so a `digest`
+    rules out splice().
+
+    :param dest: a path, a file descriptor or a file object to write to;
+        only regular files are preallocated
+    """
+
+    def __init__(self, dest, size=None, chunk_size=client.CHUNKSIZE,
+                 callback=None, digest=None):
+        super(Download, self).__init__(size, callback, digest)
+        self.dest = dest
+        self.chunk_size = chunk_size
+
+    def _open(self):
+        if isinstance(self.dest, basestring):
+            return os.open(self.dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                           0644), True
+        if isinstance(self.dest, (int, long)):
+            return self.dest, False
+        self.dest.flush()
+        return self.dest.fileno(), False
+
+    def receive(self, resp, body):
+        """Write the body of `resp` to the destination.
+
+        :param body: the :class:`client.ResponseBodyIterator` of `resp`
+        """
+        length = resp.length
+        if self.size is None:
+            self.size = length
+        raw = (length is not None and not resp.chunked and
+               not resp.getheader("content-encoding") and
+               getattr(resp.fp, "_sock", None) is not None)
+        fd, owned = None, False
+        try:
+            fd, owned = self._open()
+            # NOTE: pipes and sockets can be neither sized nor seeked;
+            #     appending would go after the space reserved
+            regular = stat.S_ISREG(os.fstat(fd).st_mode)
+            append = bool(fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_APPEND)
+            if regular and self.size and not append:
+                preallocate(fd, os.lseek(fd, 0, os.SEEK_CUR) + self.size)
+            self._start()
+            if raw:
+                self._receive_raw(resp, fd, length, append)
+                body.bytes_read = body.bytes_decoded = length
+                # the body is consumed: let the connection be reused
+                resp.close()
+                body._finish(True)
+            else:
+                body.digest = self.digest
+                for chunk in body:
+                    _write_all(fd, chunk)
+                    self._advance(len(chunk))
+            if regular:
+                # NOTE: drop the space reserved beyond a shorter body
+                os.ftruncate(fd, os.lseek(fd, 0, os.SEEK_CUR))
+        except Exception:
+            # drops the connection unless the body was read to the end
+            body.close()
+            raise
+        finally:
+            if owned:
+                os.close(fd)
+        self._finish()
+
+    def _receive_raw(self, resp, fd, length, append=False):
+        fp = resp.fp
+        # bytes already buffered by httplib go first
+        buffered = fp._rbuf.getvalue()
+        if buffered:
+            fp._rbuf.seek(0)
+            fp._rbuf.truncate()
+            buffered = buffered[:length]
+            if self.digest is not None:
+                self.digest.update(buffered)
+            _write_all(fd, buffered)
+            length -= len(buffered)
+            self._advance(len(buffered))
+        sock = fp._sock
+        # NOTE: splice() cannot write to a file opened for appending
+        if (_splice is not None and length and self.digest is None and
+                not isinstance(sock, ssl.SSLSocket) and not append):
+            length -= _splice_all(sock, fd, length, self._advance)
+        if length:
+            _recv_all(sock, fd, length,
+                      bytearray(min(self.chunk_size, length)), self._advance,
+                      self.digest)
+
+
+def download(api, url, dest, headers=None, **kwargs):
+    """Download the body of a GET request through `api` to `dest`.
+
+    :param api: a :class:`client.BaseClient`
+    :param dest: a path, a file descriptor, a file object or a
+        :class:`Download`
+    :param kwargs: passed to :class:`Download`
+    :returns: a (response, :class:`Download`) pair
+    """
+    transfer = dest
+    if not isinstance(transfer, Download):
+        transfer = Download(dest, **kwargs)
+    resp, body = api.cs_request(url, "GET", stream=True, compression=False,
+                                headers=dict(headers or {}))
+    transfer.receive(resp, body)
+    return resp, transfer
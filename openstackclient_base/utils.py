@@ -1,9 +1,22 @@
+import threading
+import time
 import uuid
+import weakref
 
 import prettytable
 
 from keystoneclient import exceptions
 
+from openstackclient_base import exceptions as base_exceptions
+
+
+# NOTE: find_resource() remembers its results, misses included, for
+#     FIND_RESOURCE_TTL seconds or until a change through the manager
+FIND_RESOURCE_TTL = 10
+_find_cache = weakref.WeakKeyDictionary()
+_find_cache_lock = threading.Lock()
+_NOT_FOUND = (exceptions.NotFound, base_exceptions.NotFound)
+
 
 # Decorator for cli-args
 def arg(*args, **kwargs):
@@ -44,29 +57,55 @@ def print_dict(d):
     print pt.get_string(sortby='Property')
 
 
+def _lookup_resource(manager, name_or_id):
+    """Return the resource named or identified by `name_or_id`, or None."""
+    by_name = (manager.find, (), {"name": name_or_id})
+    if isinstance(name_or_id, int) or name_or_id.isdigit():
+        calls = [(manager.get, (int(name_or_id),), {}), by_name]
+    else:
+        try:
+            uuid.UUID(str(name_or_id))
+        except ValueError:
+            calls = [by_name]
+        else:
+            calls = [(manager.get, (name_or_id,), {}), by_name]
+    # NOTE: an ID may as well be a name, but the name lookup lists the
+    #     whole collection: it is only done if the GET misses
+    for fn, args, kwargs in calls:
+        try:
+            return fn(*args, **kwargs)
+        except _NOT_FOUND:
+            pass
+    return None
+
+
 def find_resource(manager, name_or_id):
     """Helper for the _find_* methods."""
-    # first try to get entity as integer id
-    try:
-        if isinstance(name_or_id, int) or name_or_id.isdigit():
-            return manager.get(int(name_or_id))
-    except exceptions.NotFound:
-        pass
-
-    # now try to get entity as uuid
-    try:
-        uuid.UUID(str(name_or_id))
-        return manager.get(name_or_id)
-    except (ValueError, exceptions.NotFound):
-        pass
-
-    # finally try to find entity by name
-    try:
-        return manager.find(name=name_or_id)
-    except exceptions.NotFound:
+    # NOTE: taken before the lookup, so that a result racing with a change
+    #     is not served afterwards
+    generation = getattr(manager, "generation", None)
+    with _find_cache_lock:
+        entries = _find_cache.setdefault(manager, {})
+        entry = entries.get(name_or_id)
+    if (entry is not None and entry[0] > time.time() and
+            entry[1] == generation):
+        resource = entry[2]
+    else:
+        resource = _lookup_resource(manager, name_or_id)
+        now = time.time()
+        with _find_cache_lock:
+            if len(entries) >= 1000:
+                for key, cached in entries.items():
+                    if cached[0] <= now or cached[1] != generation:
+                        del entries[key]
+            entries[name_or_id] = (now + FIND_RESOURCE_TTL, generation,
+                                   resource)
+
+    if resource is None:
         msg = ("No %s with a name or ID of '%s' exists." %
                (manager.resource_class.__name__.lower(), name_or_id))
         raise exceptions.CommandError(msg)
+    return resource
 
 
 def unauthenticated(f):
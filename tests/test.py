@@ -1,4 +1,11 @@
+import BaseHTTPServer
+import json
 import logging
+import os
+import re
+import SocketServer
+import threading
+import time
 import uuid
 import unittest
 import sys
@@ -85,6 +92,508 @@ class NeoTests(unittest.TestCase):
         self.assertRaises(socket.gaierror, lambda: c.request('', '/users'))
 
 
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        self.server.received.append((self.command, self.path))
+        length = int(self.headers.getheader("content-length") or 0)
+        self.rfile.read(length)
+        if self.path == "/slow":
+            time.sleep(1)
+        elif self.path == "/drop":
+            # close the connection without answering
+            self.close_connection = 1
+            return
+        if self.path == "/data":
+            body = "x" * 100000
+        elif self.path == "/v2.0/tokens":
+            body = json.dumps({"access": self.server.access})
+        else:
+            body = "{}"
+        if (self.path == "/etag" and
+                self.headers.getheader("if-none-match") == '"v1"'):
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.path == "/etag":
+            self.send_header("ETag", '"v1"')
+        if self.path == "/corrupt":
+            self.send_header("Content-Encoding", "gzip")
+            body = "not gzip data"
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _handle
+
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients give up on slow requests
+        pass
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """Run a LocalServer at `url` and an HttpClient for it."""
+
+    timeout = 5
+
+    def setUp(self):
+        from openstackclient_base.client import HttpClient
+        self.server = LocalServer(("127.0.0.1", 0), LocalHandler)
+        self.server.received = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+        self.client = HttpClient(timeout=self.timeout)
+
+    def tearDown(self):
+        self.client.connection_pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _received(self, path):
+        return [request for request in self.server.received
+                if request[1] == path]
+
+
+class ReplayTests(LocalServerTestCase):
+    """A failed request on a reused connection is only sent again if it
+    cannot have been acted on.
+    """
+
+    timeout = 0.5
+
+    def setUp(self):
+        super(ReplayTests, self).setUp()
+        # leave an idle connection in the pool
+        self.client.request(self.url + "/", "GET")
+
+    def test_timeout_not_replayed(self):
+        import socket
+        self.assertRaises(socket.timeout, self.client.request,
+                          self.url + "/slow", "POST", body="x")
+        self.assertEqual(self._received("/slow"), [("POST", "/slow")])
+
+    def test_post_not_replayed(self):
+        import httplib
+        self.assertRaises(httplib.HTTPException, self.client.request,
+                          self.url + "/drop", "POST", body="x")
+        self.assertEqual(self._received("/drop"), [("POST", "/drop")])
+
+    def test_get_replayed(self):
+        import httplib
+        self.assertRaises(httplib.HTTPException, self.client.request,
+                          self.url + "/drop", "GET")
+        self.assertEqual(self._received("/drop"), [("GET", "/drop")] * 2)
+
+
+class CompressionTests(LocalServerTestCase):
+    def test_corrupt_body(self):
+        from openstackclient_base import exceptions
+        self.assertRaises(exceptions.ClientException, self.client.request,
+                          self.url + "/corrupt", "GET", compression=True)
+
+    def test_corrupt_stream(self):
+        from openstackclient_base import exceptions
+        resp, body = self.client.request(self.url + "/corrupt", "GET",
+                                         compression=True, stream=True)
+        self.assertRaises(exceptions.ClientException, list, body)
+
+
+class HttpCacheTests(LocalServerTestCase):
+    def test_revalidated(self):
+        from openstackclient_base.http_cache import HttpCache
+        self.client.http_cache = HttpCache()
+        resp, body = self.client.request(self.url + "/etag", "GET")
+        self.assertEqual((resp.status, body), (200, {}))
+        resp, body = self.client.request(self.url + "/etag", "GET")
+        self.assertEqual((resp.status, body), (200, {}))
+        self.assertTrue(resp.from_cache)
+        self.assertEqual(resp.getheader("etag"), '"v1"')
+        self.assertEqual(self.client.http_cache.counters,
+                         {"hits": 1, "misses": 1})
+
+
+class TokenRefreshTests(LocalServerTestCase):
+    """Tokens are renewed ahead of expiry only if that extends them."""
+
+    def _access(self, expires_in):
+        expires = time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                time.gmtime(time.time() + expires_in))
+        return {"token": {"id": "token", "expires": expires},
+                "serviceCatalog": [{"type": "compute",
+                                    "endpoints": [{"publicURL": self.url}]}]}
+
+    def _get(self, http_client, count):
+        from openstackclient_base.client import BaseClient
+
+        class ComputeClient(BaseClient):
+            service_type = "compute"
+
+        for i in xrange(count):
+            ComputeClient(http_client).get("/servers")
+        self.assertEqual(len(self._received("/servers")), count)
+
+    def test_access_without_credentials(self):
+        from openstackclient_base.client import HttpClient
+        self._get(HttpClient(access=self._access(30)), 5)
+        self.assertEqual(self._received("/v2.0/tokens"), [])
+
+    def test_token_credentials(self):
+        from openstackclient_base.client import HttpClient
+        self._get(HttpClient(token="token", tenant_name="tenant",
+                             auth_uri=self.url, access=self._access(30)), 5)
+        self.assertEqual(self._received("/v2.0/tokens"), [])
+
+    def test_expiry_not_extended(self):
+        from openstackclient_base.client import HttpClient
+        access = self._access(30)
+        self.server.access = access
+        self._get(HttpClient(username="user", password="password",
+                             auth_uri=self.url, access=access), 5)
+        self.assertEqual(len(self._received("/v2.0/tokens")), 1)
+
+    def test_expiry_extended(self):
+        from openstackclient_base.client import HttpClient
+        self.server.access = self._access(3600)
+        self._get(HttpClient(username="user", password="password",
+                             auth_uri=self.url, access=self._access(30)), 5)
+        self.assertEqual(len(self._received("/v2.0/tokens")), 1)
+
+
+class DownloadTests(LocalServerTestCase):
+    def cs_request(self, url, method, **kwargs):
+        return self.client.request(self.url + url, method, **kwargs)
+
+    def test_download_to_pipe(self):
+        import os
+        from openstackclient_base import transfer
+        pipe_r, pipe_w = os.pipe()
+        received = []
+        reader = threading.Thread(
+            target=lambda: received.extend(
+                iter(lambda: os.read(pipe_r, 65536), "")))
+        reader.start()
+        try:
+            resp, done = transfer.download(self, "/data", pipe_w)
+        finally:
+            os.close(pipe_w)
+            reader.join()
+            os.close(pipe_r)
+        self.assertEqual("".join(received), "x" * 100000)
+        self.assertEqual(done.bytes_done, 100000)
+
+
+    def test_download_appending(self):
+        import tempfile
+        from openstackclient_base import transfer
+        with tempfile.NamedTemporaryFile() as dest:
+            dest.write("head")
+            dest.flush()
+            with open(dest.name, "ab") as appended:
+                transfer.download(self, "/data", appended)
+            self.assertEqual(open(dest.name).read(), "head" + "x" * 100000)
+
+    def test_splice_to_appended_file(self):
+        import os
+        import socket
+        import tempfile
+        from openstackclient_base import transfer
+        if transfer._splice is None:
+            return
+        sender, receiver = socket.socketpair()
+        with tempfile.NamedTemporaryFile() as dest:
+            fd = os.open(dest.name, os.O_WRONLY | os.O_APPEND)
+            try:
+                sender.sendall("y" * 1000)
+                moved = transfer._splice_all(receiver, fd, 1000,
+                                             lambda count: None)
+            finally:
+                os.close(fd)
+                sender.close()
+                receiver.close()
+            self.assertEqual(open(dest.name).read(), "y" * moved)
+            self.assertTrue(moved > 0)
+
+
+class BodyIteratorTests(unittest.TestCase):
+    def test_map_file_opt_in(self):
+        import httplib
+        import tempfile
+        from openstackclient_base import client
+        connection = httplib.HTTPSConnection("localhost")
+        with tempfile.TemporaryFile() as body:
+            body.write("x" * 100)
+            body.seek(0)
+            self.assertTrue(isinstance(
+                client.body_iterator(connection, body),
+                client.FileReaderIterator))
+            mapped = client.body_iterator(connection, body, map_file=True)
+            self.assertTrue(isinstance(mapped, client.MmapIterator))
+            self.assertEqual("".join(map(str, mapped)), "x" * 100)
+
+
+    def test_upload_map_file(self):
+        import hashlib
+        import tempfile
+        from openstackclient_base import transfer
+        with tempfile.NamedTemporaryFile() as source:
+            source.write("x" * 100)
+            source.flush()
+            upload = transfer.Upload(source.name, chunk_size=30,
+                                     digest="md5", map_file=True)
+            # buffers are only valid until the map is closed
+            chunks = [(type(chunk), str(chunk)) for chunk in upload]
+            upload.close()
+        self.assertEqual(set(kind for kind, data in chunks), set([buffer]))
+        self.assertEqual("".join(data for kind, data in chunks), "x" * 100)
+        self.assertEqual(upload.checksum, hashlib.md5("x" * 100).hexdigest())
+
+
+class FindTests(unittest.TestCase):
+    def _manager(self, items):
+        from openstackclient_base import base
+
+        class ServerManager(base.ManagerWithFind):
+            resource_class = base.Resource
+            filter_attrs = ("name", "status")
+            regex_filter_attrs = ("name",)
+
+            def list(self, search_opts=None):
+                self.search_opts = search_opts
+                pattern = (search_opts or {}).get("name", "")
+                return [base.Resource(self, item) for item in items
+                        if re.search(pattern, item["name"])]
+
+        return ServerManager(None)
+
+    def test_regex_filter_escaped(self):
+        manager = self._manager([{"id": 1, "name": "web(1)"},
+                                 {"id": 2, "name": "web(1)-old"}])
+        found = manager.findall(name="web(1)")
+        self.assertEqual([server.id for server in found], [1])
+        self.assertEqual(manager.search_opts, {"name": r"^web\(1\)$"})
+
+
+class TokenCacheTests(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from openstackclient_base.client import HttpClient
+        from openstackclient_base.token_cache import TokenCache
+        self.path = tempfile.mkdtemp()
+        self.cache = TokenCache(os.path.join(self.path, "tokens"))
+        self.client = HttpClient(username="user", password="password",
+                                 tenant_name="tenant",
+                                 auth_uri="http://keystone:5000")
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.path)
+
+    def _access(self, token_id, expires_in):
+        expires = time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                time.gmtime(time.time() + expires_in))
+        return {"token": {"id": token_id, "expires": expires}}
+
+    def test_put_get(self):
+        access = self._access("token", 3600)
+        self.assertEqual(self.cache.get(self.client), None)
+        self.cache.put(self.client, access)
+        self.assertEqual(self.cache.get(self.client), access)
+        mode = os.stat(self.cache.path).st_mode & 0777
+        self.assertEqual(mode, 0700)
+
+    def test_expiring_ignored(self):
+        self.cache.put(self.client, self._access("token", 30))
+        self.assertEqual(self.cache.get(self.client), None)
+        self.cache.put(self.client, {"token": {"id": "token"}})
+        self.assertEqual(self.cache.get(self.client), None)
+
+    def test_key_covers_credentials(self):
+        from openstackclient_base.client import HttpClient
+        self.cache.put(self.client, self._access("token", 3600))
+        other = HttpClient(username="user", password="other",
+                           tenant_name="tenant",
+                           auth_uri="http://keystone:5000")
+        self.assertEqual(self.cache.get(other), None)
+
+    def test_discard(self):
+        self.cache.put(self.client, self._access("new", 3600))
+        # a stale token must not remove a fresher entry
+        self.cache.discard(self.client, "old")
+        self.assertNotEqual(self.cache.get(self.client), None)
+        self.cache.discard(self.client, "new")
+        self.assertEqual(self.cache.get(self.client), None)
+        self.cache.discard(self.client)
+
+
+class RetryPolicyTests(unittest.TestCase):
+    def test_parse_retry_after(self):
+        from openstackclient_base import retry
+        self.assertEqual(retry.parse_retry_after("120"), 120)
+        self.assertEqual(retry.parse_retry_after(" 7 "), 7)
+        self.assertEqual(retry.parse_retry_after(
+            "Wed, 21 Oct 2015 07:28:30 GMT", now=1445412500), 10)
+        self.assertEqual(retry.parse_retry_after(
+            "Wed, 21 Oct 2015 07:28:00 GMT", now=1445412500), 0)
+        for value in (None, "", "soon", "-5"):
+            self.assertEqual(retry.parse_retry_after(value), None)
+
+    def test_next_delay(self):
+        from openstackclient_base import exceptions
+        from openstackclient_base import retry
+        policy = retry.RetryPolicy(max_retries=2, backoff=1, max_backoff=3)
+        error = exceptions.HttpException(503)
+        for retries in xrange(2):
+            delay = policy.next_delay("GET", error, retries, 0)
+            self.assertTrue(0 <= delay <= min(3, 2 ** retries))
+        self.assertEqual(policy.next_delay("GET", error, 2, 0), None)
+        self.assertEqual(policy.counters,
+                         {"failures": 3, "retries": 2, "gave_up": 1})
+
+    def test_next_delay_not_retryable(self):
+        from openstackclient_base import exceptions
+        from openstackclient_base import retry
+        policy = retry.RetryPolicy()
+        self.assertEqual(policy.next_delay(
+            "POST", exceptions.HttpException(503), 0, 0), None)
+        self.assertEqual(policy.next_delay(
+            "GET", exceptions.HttpException(404), 0, 0), None)
+        self.assertEqual(policy.next_delay("GET", ValueError(), 0, 0), None)
+        self.assertEqual(policy.counters["gave_up"], 0)
+
+    def test_next_delay_retry_after(self):
+        from openstackclient_base import exceptions
+        from openstackclient_base import retry
+        policy = retry.RetryPolicy(total_timeout=60)
+        error = exceptions.OverLimit(413, retry_after="30")
+        self.assertEqual(policy.next_delay("GET", error, 0, 0), 30)
+        # the delay would overrun the time budget
+        self.assertEqual(policy.next_delay("GET", error, 0, 40), None)
+
+
+class PagingTests(unittest.TestCase):
+    def _manager(self):
+        from openstackclient_base import base
+        return base.Manager(None)
+
+    def _query(self, url):
+        import urlparse
+        return urlparse.parse_qs(urlparse.urlsplit(url).query)
+
+    def test_limit_in_url(self):
+        manager = self._manager()
+        self.assertEqual(manager._first_page_url("/servers?limit=5"),
+                         ("/servers?limit=5", False))
+        url, iterate = manager._first_page_url("/servers?limit=5",
+                                               iterate=True)
+        self.assertEqual(self._query(url), {"limit": ["5"]})
+        self.assertTrue(iterate)
+
+    def test_iterate_without_limit(self):
+        manager = self._manager()
+        url, iterate = manager._first_page_url("/servers?status=ACTIVE",
+                                               iterate=True, page_size=50)
+        self.assertEqual(self._query(url),
+                         {"status": ["ACTIVE"], "limit": ["50"]})
+        self.assertTrue(iterate)
+        url, iterate = manager._first_page_url("/servers")
+        self.assertEqual(self._query(url), {"limit": ["1000"]})
+        self.assertTrue(iterate)
+
+    def test_marker_replaced(self):
+        from openstackclient_base import base
+        url = base.Manager._next_page_url(
+            "/servers?status=ACTIVE&limit=10&marker=a", [{"id": "b"}], 20)
+        self.assertEqual(self._query(url), {"status": ["ACTIVE"],
+                                            "limit": ["20"],
+                                            "marker": ["b"]})
+        url = base.Manager._next_page_url(url, [{"id": "c d"}])
+        self.assertEqual(self._query(url)["marker"], ["c d"])
+        self.assertEqual(self._query(url)["limit"], ["20"])
+        self.assertEqual(base.Manager._next_page_url(url, [{}]), None)
+
+    def test_adaptive_page_size(self):
+        from openstackclient_base import base
+        sizer = base.AdaptivePageSize(initial=100, minimum=10, maximum=300,
+                                      target_time=2.0)
+        # fast pages double the size, up to the maximum
+        sizer.update(100, 0.1)
+        self.assertEqual(sizer.size, 200)
+        sizer.update(200, 0.1)
+        self.assertEqual(sizer.size, 300)
+        # a short last page changes nothing
+        sizer.update(5, 10)
+        self.assertEqual(sizer.size, 300)
+        # slow pages halve it at most, down to the minimum
+        sizer.update(300, 60)
+        self.assertEqual(sizer.size, 150)
+        sizer.update(150, 3)
+        self.assertEqual(sizer.size, 100)
+        for i in xrange(5):
+            sizer.update(sizer.size, 600)
+        self.assertEqual(sizer.size, 10)
+
+    def test_adaptive_page_size_bytes(self):
+        from openstackclient_base import base
+        sizer = base.AdaptivePageSize(initial=100, max_bytes=1000)
+        sizer.update(100, 0.1, nbytes=2000)
+        self.assertEqual(sizer.size, 50)
+
+
+class LoadAllTests(unittest.TestCase):
+    def _manager(self):
+        from openstackclient_base import base
+
+        class API(object):
+            def __init__(self):
+                self.urls = []
+
+            def get(self, url):
+                self.urls.append(url)
+                return None, {"servers": [{"id": "a", "status": "ACTIVE"},
+                                          {"id": "b", "status": "ERROR"}]}
+
+        class ServerManager(base.Manager):
+            resource_class = base.Resource
+            detail_listing = ("/servers/detail", "servers")
+            page_size = 2
+
+            def get(self, id):
+                self.api.urls.append("/servers/%s" % id)
+                return base.Resource(self, {"id": id, "status": "ACTIVE"})
+
+        return ServerManager(API())
+
+    def test_detail_listing(self):
+        from openstackclient_base import base
+        manager = self._manager()
+        servers = [base.Resource(manager, {"id": "b"}),
+                   base.Resource(manager, {"id": "c"})]
+        failures = manager.load_all(servers)
+        self.assertEqual(servers[0].status, "ERROR")
+        self.assertEqual([res.id for res, e in failures], ["c"])
+        self.assertEqual(manager.api.urls[0], "/servers/detail?limit=2")
+
+    def test_few_resources_get(self):
+        from openstackclient_base import base
+        manager = self._manager()
+        servers = [base.Resource(manager, {"id": "b"})]
+        self.assertEqual(manager.load_all(servers), [])
+        self.assertEqual(servers[0].status, "ACTIVE")
+        self.assertEqual(manager.api.urls, ["/servers/b"])
+
 if __name__ == "__main__":
     main()
     # unittest.main()